@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Compares the time a DefaultModelCollection takes to handle a
+GET, PUT and DELETE of a row by its primary key when it reuses
+the statements it has compiled, as it does, against one that
+builds and compiles its statements for every request, as it
+used to. The table is an in-memory SQLite database of 1000 rows
+and the renderer does nothing, so the times are those of the
+collection and the database.
+
+    $ python bench/bench_collection.py
+"""
+import os
+import sys
+import timeit
+import urllib
+import StringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import Table, Column, Integer, String, BoundMetaData
+from robaccia import form_parser
+from robaccia.defaultmodelcollection import DefaultModelCollection
+
+REPEAT = 2000
+
+metadata = BoundMetaData('sqlite://')
+model = Table('fred', metadata,
+        Column('id', Integer(), primary_key=True),
+        Column('description', String(250))
+        )
+
+class Collection(DefaultModelCollection):
+
+    def retrieve(self, environ, start_response):
+        pass
+
+    def update(self, environ, start_response):
+        pass
+
+    def delete(self, environ, start_response):
+        pass
+
+
+class Uncached(Collection):
+    """Compiles every statement it uses afresh."""
+    def _statement(self, *args):
+        self._statements.clear()
+        return Collection._statement(self, *args)
+
+
+def renderer(environ, start_response, template_file, vars, headers={}, status="200 Ok", raw_etag=None):
+    start_response(status, headers.items())
+    return []
+
+def start_response(status, headers):
+    pass
+
+def request(app, method, id, body=""):
+    return app({
+        "REQUEST_METHOD": method,
+        "wsgiorg.routing_args": ((), {'id': id, 'view': 'fred'}),
+        "wsgi.input": StringIO.StringIO(body),
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": len(body)
+        }, start_response)
+
+def setup():
+    model.create()
+    for i in range(1000):
+        model.insert().execute(description="Post %d" % i)
+
+def main():
+    setup()
+    body = urllib.urlencode({"description": "Edited"})
+    print "%10s %14s %14s" % ("request", "compiled (us)", "reused (us)")
+    for (method, id, body) in [("GET", "500", ""), ("PUT", "500", body), ("DELETE", "-1", "")]:
+        times = []
+        for app in [Uncached('html', renderer, form_parser, model), Collection('html', renderer, form_parser, model)]:
+            timer = timeit.Timer(lambda: request(app, method, id, body))
+            times.append(min(timer.repeat(3, REPEAT)) * 1e6 / REPEAT)
+        print "%10s %14.2f %14.2f" % (method, times[0], times[1])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Compares the time taken to route a request through the
+Dispatcher route index against a linear scan of every
+predicate in Dispatcher.matchers, for route tables of
+10, 100 and 1000 routes. The request always matches the
+last route added, the worst case for the linear scan.
+
+    $ python bench/bench_dispatcher.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from robaccia.wsgidispatcher import Dispatcher, NOMATCH
+
+REPEAT = 2000
+
+def app(environ, start_response):
+    return []
+
+def start_response(status, headers):
+    pass
+
+def build(n):
+    d = Dispatcher()
+    for i in range(n):
+        d.add("/section%d/[{id:unreserved}][;{noun}]" % i, app)
+    return d
+
+def linear(d, environ):
+    for predicate in d.matchers:
+        ret = predicate(environ, start_response)
+        if ret != NOMATCH:
+            return ret
+    return d.handle404(environ, start_response)
+
+def main():
+    print "%8s %12s %12s" % ("routes", "index (us)", "linear (us)")
+    for n in [10, 100, 1000]:
+        d = build(n)
+        path = "/section%d/42;edit_form" % (n - 1)
+        indexed = timeit.Timer(lambda: d({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}, start_response))
+        scanned = timeit.Timer(lambda: linear(d, {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}))
+        print "%8d %12.2f %12.2f" % (n,
+                min(indexed.repeat(3, REPEAT)) * 1e6 / REPEAT,
+                min(scanned.repeat(3, REPEAT)) * 1e6 / REPEAT)
+
+if __name__ == "__main__":
+    main()
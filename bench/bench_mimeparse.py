@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Compares the time taken to choose a representation with 
+mimeparse.best_match, which parses the supported mime-types
+and the Accept header on every call, against a 
+mimeparse.Negotiator, which parses the supported mime-types 
+once and remembers the result for each Accept header.
+
+    $ python bench/bench_mimeparse.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from robaccia.mimeparse import best_match, Negotiator
+
+REPEAT = 5000
+
+SUPPORTED = ['text/html', 'application/json', 'application/atom+xml', 'application/xml']
+
+HEADERS = [
+    ("browser", "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    ("json client", "application/json"),
+    ("feed reader", "application/atom+xml, application/rss+xml;q=0.9, text/xml;q=0.8, */*;q=0.1"),
+    ("anything", "*/*")
+    ]
+
+def main():
+    negotiator = Negotiator(SUPPORTED)
+    print "%12s %16s %16s" % ("header", "best_match (us)", "negotiator (us)")
+    for (name, header) in HEADERS:
+        assert best_match(SUPPORTED, header) == negotiator.best_match(header)
+        parsed = timeit.Timer(lambda: best_match(SUPPORTED, header))
+        negotiated = timeit.Timer(lambda: negotiator.best_match(header))
+        print "%12s %16.2f %16.2f" % (name,
+                min(parsed.repeat(3, REPEAT)) * 1e6 / REPEAT,
+                min(negotiated.repeat(3, REPEAT)) * 1e6 / REPEAT)
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,228 @@
 import os
+import sys
+import imp
+import glob
+import time
+import threading
+import atexit
+import Queue
 import logging
-import logging.handlers
 import mimeparse
 import md5
 from genshi.template import TemplateLoader
+from genshi.util import LRUCache as TemplateCache
 from cgi import parse_qs
 import StringIO
+from metrics import add_timing
+from cache import LRUCache
+import jsonstream
+from accesslog import QueueHandler, BackgroundWriter, BatchFileHandler, JSONFormatter, SamplingFilter
 
 TEMPLATE_DIRS = ["templates"]
 
-def genshi_templater(template_dir_paths, template_file, vars, serialization):
-    loader = TemplateLoader(template_dir_paths)
-    tmpl = loader.load(template_file)
-    stream = tmpl.generate(**vars)
-    body = stream.render(method=serialization)
+# The number of parsed templates kept by each template loader, and 
+# whether templates are checked for changes on disk each time they are
+# used. Set these before the first template is rendered.
+TEMPLATE_CACHE_SIZE = 100
+TEMPLATE_AUTO_RELOAD = False
+
+class CountingTemplateLoader(TemplateLoader):
+    """A genshi TemplateLoader that counts how often templates are
+    found in its cache, how often they have to be parsed, and 
+    the time spent parsing them."""
+    def __init__(self, *args, **kwargs):
+        TemplateLoader.__init__(self, *args, **kwargs)
+        self.loads = 0
+        self.misses = 0
+        self.parse_time = 0.0
+
+    def load(self, *args, **kwargs):
+        self.loads += 1
+        return TemplateLoader.load(self, *args, **kwargs)
+
+    def _instantiate(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return TemplateLoader._instantiate(self, *args, **kwargs)
+        finally:
+            self.misses += 1
+            self.parse_time += time.time() - start
+
+    def clear(self):
+        """Drops every parsed template, so each is read from disk again."""
+        self._lock.acquire()
+        try:
+            self._cache = TemplateCache(self._cache.capacity)
+            self._uptodate = {}
+        finally:
+            self._lock.release()
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+def template_loader(template_dir_paths):
+    """Returns the one loader for this list of template directories."""
+    key = tuple(template_dir_paths)
+    loader = _loaders.get(key, None)
+    if loader == None:
+        _loaders_lock.acquire()
+        try:
+            loader = _loaders.get(key, None)
+            if loader == None:
+                loader = _loaders[key] = CountingTemplateLoader([os.path.abspath(dir) for dir in key], 
+                        auto_reload=TEMPLATE_AUTO_RELOAD, max_cache_size=TEMPLATE_CACHE_SIZE)
+        finally:
+            _loaders_lock.release()
+    return loader
+
+def template_stats():
+    """Returns the number of template cache hits and misses, and the
+    seconds spent parsing templates, summed over all the loaders."""
+    stats = {'hits': 0, 'misses': 0, 'parse_time': 0.0}
+    for loader in _loaders.values():
+        stats['hits'] += loader.loads - loader.misses
+        stats['misses'] += loader.misses
+        stats['parse_time'] += loader.parse_time
+    return stats
+
+class TemplateIndex(object):
+    """Maps the names of the templates found under a list of template 
+    directories to the (path, mtime) of the file each one resolves to,
+    so that finding a template doesn't touch the file system. A
+    template in an earlier directory hides one of the same name in a
+    later directory, just as with TemplateLoader. The index is 
+    rebuilt by reload(), or every interval seconds by watch()."""
+    def __init__(self, template_dir_paths):
+        self.dirs = [os.path.abspath(dir) for dir in template_dir_paths]
+        self.reloads = 0
+        self._templates = {}
+        self._watcher = None
+        self.reload()
+
+    def _scan(self):
+        templates = {}
+        for dir in reversed(self.dirs):
+            for (root, dirs, files) in os.walk(dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    templates[path[len(dir):].lstrip(os.sep)] = (path, mtime)
+        return templates
+
+    def reload(self):
+        """Rescans the template directories, returning True if any
+        template was added, removed or modified since the last scan."""
+        templates = self._scan()
+        changed = templates != self._templates
+        if changed:
+            self._templates = templates
+            self.reloads += 1
+        return changed
+
+    def find(self, template_file):
+        """Returns the (path, mtime) for template_file, or None."""
+        return self._templates.get(os.path.normpath(template_file), None)
+
+    def watch(self, interval=1.0):
+        """Starts a daemon thread that reloads the index every 
+        interval seconds."""
+        if self._watcher == None:
+            self._watcher = threading.Event()
+            thread = threading.Thread(target=self._watch, args=(self._watcher, interval))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _watch(self, stopped, interval):
+        while not stopped.isSet():
+            stopped.wait(interval)
+            if not stopped.isSet():
+                self.reload()
+
+    def stop(self):
+        if self._watcher != None:
+            self._watcher.set()
+            self._watcher = None
+
+_indexes = {}
+
+def template_index(template_dir_paths):
+    """Returns the one TemplateIndex for this list of template 
+    directories, building it the first time. The index is kept 
+    up to date by a watcher if TEMPLATE_AUTO_RELOAD is set."""
+    key = tuple([os.path.abspath(dir) for dir in template_dir_paths])
+    index = _indexes.get(key, None)
+    if index == None:
+        _loaders_lock.acquire()
+        try:
+            index = _indexes.get(key, None)
+            if index == None:
+                index = _indexes[key] = TemplateIndex(key)
+                if TEMPLATE_AUTO_RELOAD:
+                    index.watch()
+        finally:
+            _loaders_lock.release()
+    return index
+
+def reload_templates():
+    """Rescans the template directories of every index and drops the
+    parsed templates of every loader, so that the templates rendered
+    are the ones the ETags are made from."""
+    for index in _indexes.values():
+        index.reload()
+    for loader in _loaders.values():
+        loader.clear()
+
+# The number of characters gathered into each chunk of a streamed response.
+STREAM_CHUNK_SIZE = 8192
+
+# The environ key a collection sets to ask render() to stream its response.
+STREAM_KEY = 'robaccia.stream'
+
+# The environ key a collection sets to ask render() to store the response
+# it renders. The value is a (cache, key, tag, generation) tuple, see 
+# robaccia.cache.RenderCache.
+RENDER_CACHE_KEY = 'robaccia.render_cache'
+
+def buffered(chunks, size=STREAM_CHUNK_SIZE, encoding=None):
+    """Gathers the many small strings produced by a serializer into
+    strings of at least size characters, encoding them if an 
+    encoding is given."""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            body = u"".join(buffer)
+            buffer = []
+            length = 0
+            yield encoding and body.encode(encoding) or body
+    if buffer:
+        body = u"".join(buffer)
+        yield encoding and body.encode(encoding) or body
+
+def genshi_templater(template_dir_paths, template_file, vars, serialization, stream=False):
+    tmpl = template_loader(template_dir_paths).load(template_file)
+    events = tmpl.generate(**vars)
+    if stream:
+        return buffered(events.serialize(method=serialization), encoding='utf-8')
+    body = events.render(method=serialization)
     return body
 
-def simplejson_templater(template_dir_paths, template_file, vars, serialization):
-    import simplejson
-    return simplejson.dumps(vars)
+def simplejson_templater(template_dir_paths, template_file, vars, serialization, stream=False):
+    if stream:
+        return buffered(jsonstream.iterencode(vars), encoding='utf-8')
+    return "".join(jsonstream.iterencode(vars))
 
 def form_parser(body):
     """Parses the incoming x-www-form-urlencoded data into a dictionary"""
     return dict([(key, "".join(value)) for key, value in parse_qs(body).iteritems()])
 
 def json_parser(body):
-    import simplejson
-    return simplejson.loads(body) 
+    return jsonstream.loads(body) 
 
 
 extensions = {
@@ -36,6 +232,32 @@ extensions = {
     'json': ('application/json', 'json', simplejson_templater, json_parser)
 }
 
+_negotiator = (None, None, None)
+ 
+def negotiate_extension(environ, default):
+    """Returns the key of the entry in extensions whose content type
+    best matches the Accept header of the request. Returns default
+    if there is no Accept header, if default is as acceptable as 
+    the best match, or if nothing in extensions is acceptable."""
+    accept = environ.get('HTTP_ACCEPT', '')
+    if not accept:
+        return default
+    global _negotiator
+    (key, negotiator, types) = _negotiator
+    if key != extensions.keys():
+        key = extensions.keys()
+        types = dict([(extensions[ext][0].split(";")[0].strip(), ext) for ext in key])
+        negotiator = mimeparse.Negotiator(types.keys())
+        _negotiator = (key, negotiator, types)
+    weighted = negotiator.qualities(accept)
+    (q, best) = max(weighted)
+    if not q:
+        return default
+    for (default_q, mime_type) in weighted:
+        if types[mime_type] == default and default_q == q:
+            return default
+    return types[best]
+
 def find_parser(ext):
     if ext in extensions:
         return extensions[ext][3]
@@ -46,26 +268,51 @@ def find_renderer(ext):
     return render
 
 def find_template(template_file):
-    for dir in TEMPLATE_DIRS:
-        full_name = os.path.join(dir, template_file)
-        if os.path.exists(full_name) and os.path.isfile(full_name):
-            return full_name
+    found = template_index(TEMPLATE_DIRS).find(template_file)
+    if found:
+        return found[0]
     return None
 
 def etag_from_raw_etag(raw_etag, template_file):
-    file = find_template(template_file)
-    if file:
-        last_modified = str(os.stat(file).st_mtime)
-        hash = md5.new(raw_etag)
-        hash.update(last_modified)
-        return '"%s"' % hash.hexdigest()
-    return None
+    """Returns an ETag built from raw_etag, the name of the template 
+    and its modification time, if the representation comes from a
+    template file."""
+    hash = md5.new(raw_etag)
+    hash.update(template_file)
+    found = template_index(TEMPLATE_DIRS).find(template_file)
+    if found:
+        hash.update(str(found[1]))
+    return '"%s"' % hash.hexdigest()
+
+def etag_matches(environ, etag):
+    """Returns True if etag is one of the entity tags in the 
+    request's If-None-Match header."""
+    header = environ.get('HTTP_IF_NONE_MATCH', '')
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return True
+    return False
  
-def render(environ, start_response, template_file, vars, headers={}, status="200 Ok", raw_etag=None):
+def render(environ, start_response, template_file, vars, headers={}, status="200 Ok", raw_etag=None, stream=None):
+    """Renders vars through the template and returns the response. 
+    If stream is True, or is None and environ[STREAM_KEY] is set,
+    the response is an iterable that serializes the template a 
+    chunk at a time, so that no more than a chunk is held in memory
+    and the first chunk is sent before the rest is rendered. A 200
+    response that isn't streamed is stored in the cache given in
+    environ[RENDER_CACHE_KEY], if any."""
+    headers = dict(headers)
+    if stream == None:
+        stream = environ.get(STREAM_KEY, False)
     if raw_etag:
         etag = etag_from_raw_etag(raw_etag, template_file)
         headers['etag'] = etag    
-        if etag == environ.get('HTTP_IF_NONE_MATCH', ''):
+        if etag_matches(environ, etag):
             return http304(environ, start_response)
 
     (contenttype, serialization, templater) = ('text/html; charset=utf-8', 'html', genshi_templater)
@@ -73,85 +320,202 @@ def render(environ, start_response, template_file, vars, headers={}, status="200
     if len(ext) > 1 and (ext[1] in extensions):
         (contenttype, serialization, templater, parser) = extensions[ext[1]]
    
-    body = templater(TEMPLATE_DIRS, template_file, vars, serialization)
+    start = time.time()
+    if stream:
+        body = templater(TEMPLATE_DIRS, template_file, vars, serialization, stream=True)
+    else:
+        body = [templater(TEMPLATE_DIRS, template_file, vars, serialization)]
+    add_timing(environ, 'render', time.time() - start)
 
     if 'content-type' not in headers:
         headers['content-type'] = contenttype
-    start_response(status, list(headers.iteritems()))
-    return [body]
+    headers = list(headers.iteritems())
+    cached = environ.pop(RENDER_CACHE_KEY, None)
+    if cached != None and not stream and status.startswith("200"):
+        (cache, key, tag, generation) = cached
+        cache.put(key, (status, headers, body[0]), tag, generation)
+    start_response(status, headers)
+    return body
+
+
+class ViewRegistry(object):
+    """Maps view names to the 'app' of the module of that name in
+    the 'views' package. Each view is imported once, the first time
+    it is asked for or when preload() is called, and the last
+    missing_size names that have no module are remembered and
+    answered with a 404.
+
+    In development mode, i.e. when reload is True, a view module
+    is reloaded whenever its file has changed since it was loaded,
+    and unknown names are looked for again on every request."""
+    def __init__(self, package="views", reload=False, missing_size=1000):
+        self.package = package
+        self.reload = reload
+        # Maps each view name to (app, filename, mtime).
+        self._views = {}
+        # The names asked for that have no view, bounded since any client can make them up.
+        self._missing = LRUCache(missing_size)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        app = self.resolve(environ['wsgiorg.routing_args'][1]['view'])
+        if app == None:
+            return http404(environ, start_response)
+        return app(environ, start_response)
 
+    def resolve(self, name):
+        """Returns the 'app' of the named view, or None if there is no such view."""
+        entry = self._views.get(name, None)
+        if entry == None:
+            if not self.reload and self._missing.get(name) != None:
+                return None
+            entry = self._load(name)
+        elif self.reload and self._changed(entry):
+            entry = self._load(name)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def preload(self):
+        """Loads every module in the views package, so that no request
+        has to wait for a view to be imported. Returns the names loaded."""
+        package = __import__(self.package, globals(), locals(), [])
+        names = []
+        for path in package.__path__:
+            for filename in glob.glob(os.path.join(path, "*.py")):
+                name = os.path.basename(filename)[:-3]
+                if not name.startswith("_") and self.resolve(name) != None:
+                    names.append(name)
+        return names
+
+    def _changed(self, entry):
+        try:
+            return os.stat(entry[1]).st_mtime != entry[2]
+        except OSError:
+            return True
+
+    def _load(self, name):
+        self._lock.acquire()
+        try:
+            entry = None
+            try:
+                package = __import__(self.package, globals(), locals(), [])
+                f, filename, description = imp.find_module(name, package.__path__)
+                if f:
+                    f.close()
+            except ImportError:
+                filename = None
+            if filename:
+                module_name = self.package + "." + name
+                previous = self._views.get(name, None)
+                module = __import__(module_name, globals(), locals(), ['app'])
+                if previous != None and module_name in sys.modules:
+                    module = reload(module)
+                entry = (module.app, filename, os.stat(filename).st_mtime)
+                logging.getLogger('robaccia').debug("View: %s", name)
+                self._views[name] = entry
+                self._missing.delete(name)
+            else:
+                self._views.pop(name, None)
+                self._missing.put(name, True)
+            return entry
+        finally:
+            self._lock.release()
+
+view_registry = ViewRegistry()
 
 def deferred_collection(environ, start_response):
     """Look for a views.* module to handle this incoming
     request. Presumes the module has 
-    an 'app' that is a WSGI application."""
-    # Pull out the view name from the template parameters
-    view = environ['wsgiorg.routing_args'][1]['view']
-    # Load the named view from the 'views' directory
-    m = __import__("views." + view, globals(), locals())
-    # Pass along the WSGI call into the given application
-    logging.getLogger('robaccia').debug("View: %s" % view)
-    return getattr(getattr(m, view), 'app')(environ, start_response)
+    an 'app' that is a WSGI application. The views are
+    looked up through view_registry."""
+    return view_registry(environ, start_response)
 
 def render_json(start_response, struct):
-    import simplejson
-    body = simplejson.dumps(struct)
     start_response("200 OK", [('Content-Type', 'text/plain')])
-    return [body]
+    return buffered(jsonstream.iterencode(struct), encoding='utf-8')
 
 def http200(environ, start_response):
-    logging.getLogger('robaccia').info("200: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("200: %s", environ.get('PATH_INFO', ''))
     start_response("200 Ok", [])
     return []
 
 def http404(environ, start_response):
-    logging.getLogger('robaccia').warning("404: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').warning("404: %s", environ.get('PATH_INFO', ''))
     start_response("404 Not Found", [('Content-Type', "text/html")])
     return ["<h1>File Not Found</h1>"]
 
 def http304(environ, start_response):
-    logging.getLogger('robaccia').info("304: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("304: %s", environ.get('PATH_INFO', ''))
     start_response("304 Not Modified", [])
     return []
 
 def http303(environ, start_response, location):
-    logging.getLogger('robaccia').info("303: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("303: %s", environ.get('PATH_INFO', ''))
     start_response("303 See Other", [('location', location)])
     return []
 
 def http405(environ, start_response):
-    logging.getLogger('robaccia').info("405: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("405: %s", environ.get('PATH_INFO', ''))
     start_response("405 Method Not Allowed", [('Content-Type', "text/html")])
     return ["<h1>That action is not allowed on this resource.</h1>"]
 
 def http403(environ, start_response):
-    logging.getLogger('robaccia').info("403: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("403: %s", environ.get('PATH_INFO', ''))
     start_response("403 Forbidden", [('Content-Type', "text/html")])
     return ["<h1>You are unauthorized to modify that resource.</h1>"]
 
 def http415(environ, start_response, message="The server is refusing to service the request because the entity of the request is in a format not supported by the requested resource for the requested method."):
-    logging.getLogger('robaccia').info("415: %s" % environ.get('PATH_INFO', ''))
+    logging.getLogger('robaccia').info("415: %s", environ.get('PATH_INFO', ''))
     start_response("415 Unsupported Media Type", [('Content-Type', "text/html")])
     return [message]
 
 
 LOG_PATH = "log"
-def init_logging():
-    if os.path.exists(LOG_PATH) and os.path.isdir(LOG_PATH):
-        logging.basicConfig(level=logging.DEBUG,
-        format='%(asctime)s %(levelname)-8s %(message)s',
-        filename='last',
-        filemode='a')
-
-        detail_handler = logging.handlers.RotatingFileHandler(os.path.join(LOG_PATH, "detail.log"), "a", 100000, 5)
-        detail_handler.setLevel(logging.DEBUG)
-        detail_handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)-8s %(message)s'))
-        logdetail = logging.getLogger('robaccia')
-        logdetail.addHandler(detail_handler)
-
-        request_handler = logging.handlers.RotatingFileHandler(os.path.join(LOG_PATH, "request.log"), "a", 100000, 5)
-        request_handler.setLevel(logging.INFO)
-        request_handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)-8s %(message)s'))
-        logrequest = logging.getLogger('robaccia.request')
-        logrequest.addHandler(request_handler)
+LOG_MAX_BYTES = 100000
+LOG_BACKUP_COUNT = 5
+_log_writer = None
+
+def init_logging(max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, debug_sample_rate=1.0, queue_size=10000):
+    """Sets up logging into LOG_PATH, if that directory exists.
+    Records are queued and written out in batches by a background
+    thread, so request threads never wait on the disk. If the queue
+    of queue_size records fills up then records are dropped.
+
+    The files written are 'last' for everything, 'detail.log' for the 
+    'robaccia' logger, 'request.log' for 'robaccia.request' and 
+    'access.log', with one JSON object per request, for the 
+    'robaccia.access' logger that the accesslog.AccessLog middleware
+    writes to. Each log file rotates when it reaches max_bytes, 
+    keeping backup_count old files. Only a debug_sample_rate fraction, 
+    between 0.0 and 1.0, of DEBUG records are kept.
+    """
+    global _log_writer
+    if os.path.exists(LOG_PATH) and os.path.isdir(LOG_PATH) and _log_writer == None:
+        queue = Queue.Queue(queue_size)
+        _log_writer = BackgroundWriter(queue)
+
+        def add_handler(logger, filename, level, formatter, sample):
+            handler = BatchFileHandler(filename, "a", max_bytes, backup_count)
+            handler.setLevel(level)
+            handler.setFormatter(formatter)
+            queued = QueueHandler(queue, handler)
+            if sample:
+                queued.addFilter(SamplingFilter(debug_sample_rate))
+            logger.addHandler(queued)
+
+        logging.getLogger().setLevel(logging.DEBUG)
+        add_handler(logging.getLogger(), 'last', logging.DEBUG, 
+                logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'), True)
+        add_handler(logging.getLogger('robaccia'), os.path.join(LOG_PATH, "detail.log"), logging.DEBUG, 
+                logging.Formatter('%(asctime)s: %(levelname)-8s %(message)s'), True)
+        add_handler(logging.getLogger('robaccia.request'), os.path.join(LOG_PATH, "request.log"), logging.INFO, 
+                logging.Formatter('%(asctime)s: %(levelname)-8s %(message)s'), False)
+
+        logaccess = logging.getLogger('robaccia.access')
+        logaccess.propagate = False
+        add_handler(logaccess, os.path.join(LOG_PATH, "access.log"), logging.INFO, JSONFormatter(), False)
+
+        _log_writer.start()
+        atexit.register(_log_writer.stop)
 
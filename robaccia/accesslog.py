@@ -0,0 +1,205 @@
+"""
+Access Log
+
+Logging that stays off the request path. Records are handed
+to a QueueHandler, which only puts them on a queue, and a
+BackgroundWriter thread takes them off the queue in batches,
+writes each batch to the files it is bound for and only then
+flushes them.
+
+AccessLog is WSGI middleware that writes one JSON object per
+line for every request to the 'robaccia.access' logger, with
+the method, path, matched route, status, bytes sent, duration
+in seconds and a request id::
+
+    {"time": "2007-08-07 12:00:00,123", "method": "GET", "path": "/bin/12", 
+     "route": "/{view:alnum}/[{id:unreserved}][;{noun:unreserved}]", 
+     "status": "200", "bytes": 1421, "duration": 0.0042, "request_id": "3f2a-1c"}
+
+robaccia.init_logging() sets all of this up for the log
+directory of a project.
+"""
+
+import os
+import time
+import random
+import logging
+import logging.handlers
+import threading
+import itertools
+import Queue
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for a BackgroundWriter to pass to 
+    the target handler. Never blocks; if the queue is full the
+    record is dropped and counted in ``dropped``."""
+    def __init__(self, queue, target):
+        logging.Handler.__init__(self, target.level)
+        self.queue = queue
+        self.target = target
+        self.dropped = 0
+
+    def emit(self, record):
+        if record.exc_info:
+            # Tracebacks hold on to frames, so they are formatted now.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait((self.target, record))
+        except Queue.Full:
+            self.dropped += 1
+
+
+class BackgroundWriter(threading.Thread):
+    """Takes (handler, record) pairs off a queue, up to batch_size
+    at a time, and passes them to their handlers, flushing each
+    handler once per batch."""
+    def __init__(self, queue, batch_size=256):
+        threading.Thread.__init__(self, name="robaccia-log-writer")
+        self.setDaemon(True)
+        self.queue = queue
+        self.batch_size = batch_size
+        self._stopping = False
+
+    def run(self):
+        while not self._stopping or not self.queue.empty():
+            try:
+                batch = [self.queue.get(True, 0.5)]
+            except Queue.Empty:
+                continue
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            self.write(batch)
+
+    def write(self, batch):
+        handlers = {}
+        for handler, record in batch:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+                handlers[id(handler)] = handler
+        for handler in handlers.itervalues():
+            handler.flush()
+
+    def stop(self, timeout=5):
+        """Writes out everything already queued and stops the thread."""
+        self._stopping = True
+        self.join(timeout)
+
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    """A RotatingFileHandler that does not flush after every
+    record, leaving that to the BackgroundWriter, and only
+    formats each record once."""
+    def emit(self, record):
+        try:
+            msg = "%s\n" % self.format(record)
+            if isinstance(msg, unicode):
+                msg = msg.encode("utf-8")
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0:
+                self.stream.seek(0, 2)
+                if self.stream.tell() + len(msg) >= self.maxBytes:
+                    self.doRollover()
+            self.stream.write(msg)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object. The fields
+    of records logged with an 'access' dictionary in their extra
+    arguments are used as is, otherwise the level and message 
+    are used."""
+    def format(self, record):
+        fields = {"time": self.formatTime(record)}
+        access = getattr(record, "access", None)
+        if access != None:
+            fields.update(access)
+        else:
+            fields["level"] = record.levelname
+            fields["message"] = record.getMessage()
+        return json.dumps(fields)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes every record above DEBUG and only a ``rate``
+    fraction, between 0.0 and 1.0, of the DEBUG records."""
+    def __init__(self, rate=1.0):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class _Counted(object):
+    """Wraps a response iterable to count the bytes sent,
+    calling on_close(bytes) when the server closes it."""
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close(self.bytes)
+
+
+class AccessLog(object):
+    """WSGI middleware that logs a structured access record for 
+    every request once its response has been sent. The request id
+    is taken from an X-Request-Id header if there is one, and is
+    made available to the application in environ['robaccia.request_id']."""
+    def __init__(self, app, logger_name='robaccia.access'):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+        self._prefix = "%x%x" % (os.getpid(), int(time.time()) & 0xffff)
+        self._count = itertools.count(1) # next() is atomic, ids don't repeat across threads
+
+    def _request_id(self):
+        return "%s-%x" % (self._prefix, self._count.next())
+
+    def __call__(self, environ, start_response):
+        start = time.time()
+        request_id = environ.get('HTTP_X_REQUEST_ID', '') or self._request_id()
+        environ['robaccia.request_id'] = request_id
+        method = environ.get('REQUEST_METHOD', 'GET')
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        status = ['-']
+        def logged_start_response(response_status, response_headers, exc_info=None):
+            status[0] = response_status.split(' ', 1)[0]
+            if exc_info:
+                return start_response(response_status, response_headers, exc_info)
+            return start_response(response_status, response_headers)
+
+        def on_close(bytes):
+            self.logger.info("access", extra={'access': {
+                'method': method,
+                'path': path,
+                'route': environ.get('robaccia.route', None),
+                'status': status[0],
+                'bytes': bytes,
+                'duration': round(time.time() - start, 6),
+                'request_id': request_id
+                }})
+
+        return _Counted(self.app(environ, logged_start_response), on_close)
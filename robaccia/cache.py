@@ -0,0 +1,256 @@
+"""
+Cache
+
+A small, thread-safe, bounded cache that discards the least
+recently used entries first. It keeps counts of hits, misses
+and evictions so that the effectiveness of the cache can be
+measured::
+
+    from robaccia.cache import LRUCache
+
+    c = LRUCache(2)
+    c.put('a', 1)
+    c.put('b', 2)
+    c.get('a')      # 1, and 'a' is now the most recently used
+    c.put('c', 3)   # 'b' is evicted
+    c.get('b')      # None
+    c.stats()       # {'size': 2, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+RenderCache is an LRUCache for rendered responses. It is also 
+bounded by the total size of the bodies it holds, its entries 
+expire, and each entry is tagged so that everything rendered from
+one table can be dropped when that table is written to::
+
+    c = RenderCache(max_bytes=1024*1024, ttl=60)
+    generation = c.generation('pastes')
+    # ... read the row and render it ...
+    c.put(key, ("200 Ok", headers, body), 'pastes', generation)
+    c.get(key)      # ("200 Ok", headers, body)
+    c.invalidate('pastes')
+    c.get(key)      # None
+
+Passing the generation read before the database was queried means
+that a response rendered from data that was written to while it 
+was being rendered is not stored.
+"""
+
+import threading
+import time
+
+# Each entry is a link in a circular doubly linked list,
+# ordered from least to most recently used.
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+
+    def __init__(self, size=1000):
+        """
+size - The maximum number of entries kept in the cache.
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._map = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _append(self, link):
+        root = self._root
+        last = root[PREV]
+        link[PREV] = last
+        link[NEXT] = root
+        last[NEXT] = root[PREV] = link
+
+    def get(self, key, default=None):
+        """Returns the value stored for key, or default if there
+        is none, and marks the entry as the most recently used."""
+        self._lock.acquire()
+        try:
+            link = self._map.get(key, None)
+            if link == None:
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[VALUE]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """Stores value for key, evicting the least recently used
+        entry if the cache is full."""
+        self._lock.acquire()
+        try:
+            link = self._map.get(key, None)
+            if link != None:
+                self._unlink(link)
+            elif len(self._map) >= self.size:
+                self._evict()
+            link = [None, None, key, value]
+            self._map[key] = link
+            self._append(link)
+        finally:
+            self._lock.release()
+
+    def _remove(self, link):
+        self._unlink(link)
+        del self._map[link[KEY]]
+
+    def _evict(self):
+        self._remove(self._root[NEXT])
+        self.evictions += 1
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key, None)
+            if link != None:
+                self._remove(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map = {}
+            self._root[:] = [self._root, self._root, None, None]
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'size': len(self._map),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+# The parts of a RenderCache entry value.
+EXPIRES, TAG, BYTES, RESPONSE = 0, 1, 2, 3
+
+class RenderCache(LRUCache):
+
+    def __init__(self, size=1000, max_bytes=16*1024*1024, ttl=300):
+        """
+size - The maximum number of entries kept in the cache.
+max_bytes - The maximum total length of the bodies kept in the cache.
+ttl - The number of seconds an entry is kept, or None to keep 
+      entries until they are evicted or invalidated.
+        """
+        LRUCache.__init__(self, size)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._tags = {}
+        self._generations = {}
+
+    def _remove(self, link):
+        LRUCache._remove(self, link)
+        (expires, tag, nbytes, response) = link[VALUE]
+        self.bytes -= nbytes
+        keys = self._tags.get(tag, None)
+        if keys != None:
+            keys.discard(link[KEY])
+            if not keys:
+                del self._tags[tag]
+
+    def get(self, key, default=None):
+        """Returns the response stored for key, or default if there
+        is none or it has expired."""
+        self._lock.acquire()
+        try:
+            link = self._map.get(key, None)
+            if link != None:
+                expires = link[VALUE][EXPIRES]
+                if expires != None and expires < time.time():
+                    self._remove(link)
+                    self.expirations += 1
+                    link = None
+            if link == None:
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[VALUE][RESPONSE]
+        finally:
+            self._lock.release()
+
+    def put(self, key, response, tag=None, generation=None):
+        """Stores response, a (status, headers, body) tuple, for key
+        and returns True. The response is not stored, and False is 
+        returned, if the body is larger than max_bytes or if tag has 
+        been invalidated since generation was read."""
+        expires = None
+        if self.ttl != None:
+            expires = time.time() + self.ttl
+        return self._store(key, response, len(response[2]), expires, tag, generation)
+
+    def _store(self, key, response, nbytes, expires, tag, generation):
+        if nbytes > self.max_bytes:
+            return False
+        self._lock.acquire()
+        try:
+            if generation != None and generation != self._generations.get(tag, 0):
+                return False
+            link = self._map.get(key, None)
+            if link != None:
+                self._remove(link)
+            while self._map and (len(self._map) >= self.size or self.bytes + nbytes > self.max_bytes):
+                self._evict()
+            link = [None, None, key, (expires, tag, nbytes, response)]
+            self._map[key] = link
+            self._append(link)
+            self.bytes += nbytes
+            self._tags.setdefault(tag, set()).add(key)
+            return True
+        finally:
+            self._lock.release()
+
+    def generation(self, tag):
+        """Returns a number that changes each time tag is invalidated."""
+        return self._generations.get(tag, 0)
+
+    def invalidate(self, tag):
+        """Drops every entry stored with tag."""
+        self._lock.acquire()
+        try:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in list(self._tags.get(tag, ())):
+                self._remove(self._map[key])
+                self.invalidations += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map = {}
+            self._root[:] = [self._root, self._root, None, None]
+            self.bytes = 0
+            self._tags = {}
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        stats = LRUCache.stats(self)
+        stats['bytes'] = self.bytes
+        stats['expirations'] = self.expirations
+        stats['invalidations'] = self.invalidations
+        return stats
@@ -0,0 +1,268 @@
+"""
+Compress
+
+WSGI middleware that compresses responses with gzip or deflate
+for the clients that accept them::
+
+    from robaccia.compress import Compress
+
+    app = Compress(app)
+
+The encoding is chosen from the Accept-Encoding header of the
+request. Only textual content types are compressed, and only
+bodies of at least min_size bytes, so small responses and images
+go out as they are. Bodies are compressed a chunk at a time as the
+application produces them, and each chunk of a streamed response,
+one whose body isn't a list, is flushed to the client as it is
+compressed, so a streamed response stays streamed.
+Responses that could be compressed get a 'Vary: Accept-Encoding'
+header whether or not they were.
+
+A compressed response gets its own ETag, the ETag of the response
+with '-gzip' or '-deflate' added, and that suffix is removed from
+If-None-Match before the request is passed on. The compressed bytes
+of the last cache_size responses with an ETag are kept, up to a
+total of cache_bytes, so that a popular response is compressed once
+rather than on every request.
+"""
+
+import zlib
+from cache import RenderCache
+
+# The content types that are worth compressing, along with any
+# text/* type and any type ending in '+xml' or '+json'.
+COMPRESSIBLE = set([
+    'application/json',
+    'application/javascript',
+    'application/x-javascript',
+    'application/xml',
+    'image/svg+xml'
+    ])
+
+# The wbits that zlib needs for each encoding, gzip wants a header
+# and trailer and deflate means the zlib format in HTTP.
+ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+    }
+
+def choose_encoding(accept_encoding):
+    """Returns 'gzip', 'deflate' or None for an Accept-Encoding header,
+    preferring gzip when the client accepts both equally."""
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        parts = coding.split(";")
+        name = parts[0].strip().lower()
+        if name == 'x-gzip':
+            name = 'gzip'
+        q = 1.0
+        for param in parts[1:]:
+            (key, sep, value) = param.partition("=")
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    best = None
+    for name in ['gzip', 'deflate']:
+        q = qualities.get(name, qualities.get('*', 0.0))
+        if q > 0 and (best == None or q > best[0]):
+            best = (q, name)
+    if best == None:
+        return None
+    return best[1]
+
+def compressible(content_type):
+    content_type = content_type.split(";")[0].strip().lower()
+    return (content_type.startswith('text/') or content_type in COMPRESSIBLE
+            or content_type.endswith('+xml') or content_type.endswith('+json'))
+
+def _header(headers, name):
+    for (key, value) in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+def _without(headers, names):
+    return [(key, value) for (key, value) in headers if key.lower() not in names]
+
+def _add_vary(headers):
+    vary = _header(headers, 'vary')
+    if vary == None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return headers
+    return _without(headers, ['vary']) + [('Vary', vary + ', Accept-Encoding')]
+
+def _encoded_etag(etag, encoding):
+    if etag.endswith('"'):
+        return '%s-%s"' % (etag[:-1], encoding)
+    return '%s-%s' % (etag, encoding)
+
+def _strip_encodings(if_none_match):
+    for encoding in ENCODINGS:
+        if_none_match = if_none_match.replace('-%s"' % encoding, '"')
+    return if_none_match
+
+
+class Compress(object):
+
+    def __init__(self, app, min_size=512, level=6, cache_size=1000, cache_bytes=16*1024*1024):
+        """
+app - The WSGI application whose responses are compressed.
+min_size - Bodies shorter than this many bytes are sent as they are.
+level - The zlib compression level, 1 to 9.
+cache_size - The number of compressed responses kept, 0 for none.
+cache_bytes - The maximum total size of the compressed responses kept.
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.cache = None
+        if cache_size:
+            self.cache = RenderCache(cache_size, cache_bytes, ttl=None)
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') == 'HEAD':
+            return self.app(environ, start_response)
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding and 'HTTP_IF_NONE_MATCH' in environ:
+            environ['HTTP_IF_NONE_MATCH'] = _strip_encodings(environ['HTTP_IF_NONE_MATCH'])
+
+        response = []
+        written = []
+        def compress_start_response(status, headers, exc_info=None):
+            # Nothing has been sent yet, so an error response
+            # simply replaces the response.
+            response[:] = [status, headers]
+            return written.append
+
+        app_iter = self.app(environ, compress_start_response)
+        streamed = not isinstance(app_iter, (list, tuple))
+        if not response:
+            # A generator calls start_response when it is first iterated.
+            app_iter = _Chained([], app_iter)
+            app_iter.prime(written)
+            written = []
+            if not response:
+                # Nothing to compress, so leave it to the server.
+                return app_iter
+        (status, headers) = response
+        content_type = _header(headers, 'content-type') or ''
+        if not compressible(content_type):
+            start_response(status, headers)
+            return self._chain(written, app_iter)
+        headers = _add_vary(headers)
+        length = _header(headers, 'content-length')
+        if (encoding == None or status[:3] in ('204', '304')
+                or _header(headers, 'content-encoding') != None
+                or 'no-transform' in (_header(headers, 'cache-control') or '')
+                or (length != None and int(length) < self.min_size)):
+            start_response(status, headers)
+            return self._chain(written, app_iter)
+
+        key = None
+        etag = _header(headers, 'etag')
+        if self.cache != None and etag and status.startswith('200'):
+            key = (environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+                    environ.get('QUERY_STRING', ''), etag, encoding)
+            cached = self.cache.get(key)
+            if cached != None:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+                (status, headers, body) = cached
+                start_response(status, headers)
+                return [body]
+        return self._compress(start_response, status, headers, encoding,
+                self._chain(written, app_iter), key, streamed)
+
+    def _chain(self, written, app_iter):
+        """Returns the body, including anything the application
+        passed to write(), closing app_iter when done."""
+        if not written:
+            return app_iter
+        return _Chained(written, app_iter)
+
+    def _compress(self, start_response, status, headers, encoding, body, key, streamed):
+        # The body is buffered until there is enough of it to
+        # be worth compressing.
+        chunks = []
+        size = 0
+        iterator = iter(body)
+        try:
+            for chunk in iterator:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            if size < self.min_size:
+                start_response(status, headers)
+                yield "".join(chunks)
+                return
+
+            etag = _header(headers, 'etag')
+            headers = _without(headers, ['content-length', 'etag'])
+            headers.append(('Content-Encoding', encoding))
+            if etag:
+                headers.append(('ETag', _encoded_etag(etag, encoding)))
+            start_response(status, headers)
+
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, ENCODINGS[encoding])
+            kept = []
+            kept_size = 0
+            for chunk in _resume(chunks, iterator):
+                data = compressor.compress(chunk)
+                if streamed:
+                    data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    if key != None:
+                        kept.append(data)
+                        kept_size += len(data)
+                        if kept_size > self.cache.max_bytes:
+                            key = None
+                            kept = []
+                    yield data
+            data = compressor.flush()
+            yield data
+            if key != None:
+                kept.append(data)
+                self.cache.put(key, (status, headers, "".join(kept)))
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+def _resume(chunks, iterator):
+    for chunk in chunks:
+        yield chunk
+    for chunk in iterator:
+        yield chunk
+
+
+class _Chained(object):
+    """The chunks passed to write() followed by the application's
+    iterable, which is closed when this is."""
+    def __init__(self, written, app_iter):
+        self.written = written
+        self.app_iter = app_iter
+        self.iterator = None
+
+    def prime(self, written):
+        """Takes the first chunk of the application's iterable, so that 
+        it calls start_response, and keeps it after anything written."""
+        self.iterator = iter(self.app_iter)
+        for chunk in self.iterator:
+            written.append(chunk)
+            break
+        self.written = written
+
+    def __iter__(self):
+        for chunk in self.written:
+            yield chunk
+        for chunk in self.iterator or self.app_iter:
+            yield chunk
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
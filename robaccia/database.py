@@ -0,0 +1,177 @@
+"""
+Database
+
+Sets up the engine that the models of a project are bound to,
+with a connection pool of a fixed size and, for SQLite, the
+pragmas that let readers and writers work at the same time.
+The dbconfig.py of a project uses it like this::
+
+    from robaccia.database import configure
+
+    metadata = configure('sqlite:///database.db', pool_size=5,
+            journal_mode='WAL', synchronous='NORMAL',
+            mmap_size=64*1024*1024, cache_size=-8000)
+
+For SQLite each thread gets a connection of its own, which it
+keeps and reuses, and at most pool_size threads use a connection
+at once; the rest wait, for up to timeout seconds. In WAL journal
+mode readers don't block writers and writers don't block readers,
+and synchronous=NORMAL only syncs the log at checkpoints, which is
+still safe against corruption in WAL mode.
+
+Other databases get SQLAlchemy's QueuePool with the same pool_size
+and timeout.
+
+pool_stats() returns, for each configured database, the number of
+checkouts, the connections in use now and at most, and the number
+and total seconds of checkouts that had to wait for a connection.
+"""
+
+import time
+import threading
+from sqlalchemy import create_engine, BoundMetaData, exceptions
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool
+
+# The pools made by configure(), keyed by database URL.
+pools = {}
+
+def sqlite_creator(filename, journal_mode='WAL', synchronous='NORMAL', mmap_size=None, cache_size=None, busy_timeout=5.0):
+    """Returns a function that opens a connection to the SQLite
+    database in filename and sets the given pragmas on it. Pragmas
+    that are None are left at SQLite's defaults."""
+    try:
+        from pysqlite2 import dbapi2 as sqlite
+    except ImportError:
+        from sqlite3 import dbapi2 as sqlite
+    pragmas = [(name, value) for (name, value) in [
+            ('journal_mode', journal_mode),
+            ('synchronous', synchronous),
+            ('mmap_size', mmap_size),
+            ('cache_size', cache_size)] if value != None]
+    def connect():
+        connection = sqlite.connect(filename, timeout=busy_timeout)
+        # The journal mode can't be changed inside a transaction.
+        isolation_level = connection.isolation_level
+        connection.isolation_level = None
+        for (name, value) in pragmas:
+            connection.execute("PRAGMA %s=%s" % (name, value)).fetchall()
+        connection.isolation_level = isolation_level
+        return connection
+    return connect
+
+
+class ThreadAffinePool(Pool):
+    """A pool that gives each thread a connection of its own, that
+    is only ever used by that thread, and lets at most pool_size
+    threads hold a connection at once. A thread's connection is
+    closed when the thread goes away."""
+
+    def __init__(self, creator, pool_size=5, timeout=30, **params):
+        params['use_threadlocal'] = True
+        Pool.__init__(self, creator, **params)
+        self.size = pool_size
+        self.timeout = timeout
+        self.checkouts = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self._local = threading.local()
+        self._available = threading.Condition(threading.Lock())
+
+    def recreate(self):
+        self.log("Pool recreating")
+        return ThreadAffinePool(self._creator, pool_size=self.size, timeout=self.timeout, recycle=self._recycle,
+                echo=self.echo, auto_close_cursors=self.auto_close_cursors,
+                disallow_open_cursors=self.disallow_open_cursors)
+
+    def dispose(self):
+        """Closes the calling thread's connection. The connections of
+        other threads can only be closed by those threads, and are
+        closed when the threads go away."""
+        record = getattr(self._local, 'record', None)
+        if record != None:
+            record.close()
+            self._local.record = None
+
+    def do_get(self):
+        self._available.acquire()
+        try:
+            if self.in_use >= self.size:
+                start = time.time()
+                self.waits += 1
+                while self.in_use >= self.size:
+                    remaining = start + self.timeout - time.time()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        self.wait_time += time.time() - start
+                        raise exceptions.TimeoutError("ThreadAffinePool limit of size %d reached, connection timed out" % self.size)
+                    self._available.wait(remaining)
+                self.wait_time += time.time() - start
+            self.in_use += 1
+            self.checkouts += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        finally:
+            self._available.release()
+        try:
+            record = getattr(self._local, 'record', None)
+            if record == None:
+                record = self._local.record = self.create_connection()
+            return record
+        except:
+            self._release()
+            raise
+
+    def do_return_conn(self, conn):
+        self._release()
+
+    def _release(self):
+        self._available.acquire()
+        try:
+            self.in_use -= 1
+            self._available.notify()
+        finally:
+            self._available.release()
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'checkouts': self.checkouts,
+            'in_use': self.in_use,
+            'max_in_use': self.max_in_use,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'timeouts': self.timeouts
+        }
+
+    def status(self):
+        return "ThreadAffinePool id:%d size: %d in use: %d" % (id(self), self.size, self.in_use)
+
+
+def configure(url, pool_size=5, timeout=30, journal_mode='WAL', synchronous='NORMAL', mmap_size=None, cache_size=None, **kwargs):
+    """Returns a BoundMetaData for the database at url, with a pool
+    of pool_size connections. The journal_mode, synchronous,
+    mmap_size and cache_size pragmas only apply to SQLite, and
+    any other keyword arguments are passed on to create_engine()."""
+    parsed = make_url(url)
+    if parsed.drivername == 'sqlite':
+        creator = sqlite_creator(parsed.database or ':memory:', journal_mode, synchronous, mmap_size, cache_size)
+        pool = ThreadAffinePool(creator, pool_size=pool_size, timeout=timeout)
+        engine = create_engine(url, pool=pool, **kwargs)
+    else:
+        engine = create_engine(url, pool_size=pool_size, pool_timeout=timeout, **kwargs)
+        pool = engine.connection_provider._pool
+    pools[str(url)] = pool
+    return BoundMetaData(engine)
+
+def pool_stats():
+    """Returns the statistics of the pool of each configured database."""
+    stats = {}
+    for (url, pool) in pools.items():
+        if hasattr(pool, 'stats'):
+            stats[url] = pool.stats()
+        else:
+            stats[url] = {'size': pool.size(), 'in_use': pool.checkedout()}
+    return stats
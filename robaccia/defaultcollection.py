@@ -41,26 +41,36 @@ See robaccia.render for a complete description.
 
 
 
-from wsgicollection import Collection
+from wsgicollection import Collection, CollectionRequest
+from robaccia import negotiate_extension
 import os
 
 class DefaultCollection(Collection):
 
-    def __init__(self, ext, renderer):
+    def __init__(self, ext, renderer, negotiate=False):
+        """If negotiate is True then the representation is chosen from
+        robaccia.extensions by the Accept header of the request, with
+        ext used when there is no better match."""
         Collection.__init__(self)
         self._ext = ext
         self._renderer = renderer
+        self._negotiate = negotiate
 
     def __call__(self, environ, start_response):
-        response = Collection.__call__(self, environ, start_response)
+        request = CollectionRequest()
+        response = self._dispatch(environ, start_response, request)
         if response == None:
-            if self._id:
-                response = {'id': self._id}
+            if request.id:
+                response = {'id': request.id}
             else:
                 response = {}
         if isinstance(response, dict):
             view = environ['wsgiorg.routing_args'][1].get('view', '.')
-            template_file = os.path.join(view, self._function_name + "." + self._ext)
+            if self._negotiate:
+                ext = negotiate_extension(environ, self._ext)
+                template_file = os.path.join(view, request.function_name + "." + ext)
+                return self._renderer(environ, start_response, template_file, response, {'vary': 'Accept'}) 
+            template_file = os.path.join(view, request.function_name + "." + self._ext)
             return self._renderer(environ, start_response, template_file, response) 
         else:
             return response
@@ -41,65 +41,401 @@ See robaccia.render for a complete description.
 
 
 
-from wsgicollection import Collection
+from wsgicollection import Collection, CollectionRequest, request_property
 import os
-from robaccia import http200, http405, http404, http303
+import time
+import threading
+import urllib
+from cgi import parse_qs
+from sqlalchemy import select, asc, desc, types, bindparam
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from robaccia import http200, http405, http404, http303, http304, STREAM_KEY, RENDER_CACHE_KEY
+from robaccia import etag_from_raw_etag, etag_matches, negotiate_extension
+from metrics import add_timing
+from rows import row_class
+from cache import LRUCache
+
+# The number of writes made to each table through a DefaultModelCollection
+# in this process, and the time of the last one. Along with GENERATION, 
+# which is different each time the process starts, they tell whether a 
+# representation of a table is current, as long as this process is the
+# only one that writes to the table.
+GENERATION = "%d.%d" % (os.getpid(), int(time.time()))
+_started = time.time()
+_versions = {}
+_versions_lock = threading.Lock()
+
+def table_version(name):
+    """Returns (version, last_modified) for the table called name."""
+    return _versions.get(name, (0, _started))
+
+def table_changed(name):
+    _versions_lock.acquire()
+    try:
+        (version, last_modified) = table_version(name)
+        _versions[name] = (version + 1, time.time())
+    finally:
+        _versions_lock.release()
 
 class DefaultModelCollection(Collection):
 
-    def __init__(self, ext, renderer, parser, model):
+    def __init__(self, ext, renderer, parser, model, stream=False, render_cache=None, table_validators=False, negotiate=False,
+            page_size=None, max_page_size=1000, fetch_size=500, list_fields=None, row_cache=None):
+        """If stream is True then the rows of a list are read from the
+        database as they are rendered, and the rendered response is
+        streamed, instead of being built up in memory first. Rows are
+        read from the cursor fetch_size at a time, so that only one
+        batch of raw rows is held in memory, streaming or not.
+
+        If render_cache, a robaccia.cache.RenderCache, is given then 
+        GETs are answered from it when they can be, and the responses
+        rendered for GETs are stored in it. Every PUT, DELETE or POST
+        drops the responses cached for the model, so the cache should
+        only be used if all the writes to the table go through this
+        collection.
+
+        Retrieved rows get an ETag made from a hash of their contents,
+        and a request with a matching If-None-Match gets a 304 before
+        the template is rendered. If table_validators is True then the 
+        ETag and Last-Modified of both rows and lists come from the 
+        number of writes made to the table instead, and conditional 
+        requests are answered before the table is queried. That is only
+        correct if every write to the table goes through a 
+        DefaultModelCollection in this one process.
+
+        If negotiate is True then the representation is chosen from
+        robaccia.extensions by the Accept header of the request, with
+        ext used when there is no better match.
+
+        A list is returned a page at a time if page_size is given, or
+        if the request has a 'limit', 'after' or 'before' query 
+        parameter. Pages are found by seeking on the primary key, so
+        a page costs the same however deep into the table it is:
+
+            GET /fred/?limit=20             the first 20 rows
+            GET /fred/?after=120&limit=20   the 20 rows after id 120
+            GET /fred/?before=120&limit=20  the 20 rows before id 120
+
+        The limit defaults to page_size and is never more than 
+        max_page_size. The template gets a 'page' dictionary with the
+        'limit' and the query strings of the 'next' and 'prev' pages,
+        which are None when there are no such pages.
+
+        A 'fields' query parameter, a comma separated list of column
+        names, selects only those columns of the rows, and 
+        list_fields is the list of columns selected for a list when
+        there is no 'fields' parameter. The primary key is always 
+        selected, and 'meta' is the list of the columns selected.
+
+        If row_cache, a robaccia.rowcache.RowCache, is given then 
+        a row is looked for there before the table is queried, and the
+        row read from the table, or the fact that there is no such row,
+        is stored there. A PUT or DELETE drops the row from the cache,
+        and a POST drops any entry for the id of the new row."""
         Collection.__init__(self)
         self._ext = ext
         self._renderer = renderer # converts dicts to representations
         self._model = model
         self._parser = parser     # converts representations to dicts
-        self._repr = {}           # request representation as a dict()
+        self._stream = stream
+        self._render_cache = render_cache
+        self._table_validators = table_validators
+        self._negotiate = negotiate
+        self._page_size = page_size
+        self._max_page_size = max_page_size
+        self._fetch_size = fetch_size
+        self._list_fields = list_fields
+        self._row_cache = row_cache
+        self._primary = None
+        if model != None:
+            self._primary = model.primary_key.columns.keys()[0]
+        self._statements = LRUCache(200) # compiled statements, see _statement()
+
+    _repr = request_property('repr') # request representation as a dict()
 
     def __call__(self, environ, start_response):
+        request = CollectionRequest()
 
         size = environ.get('CONTENT_LENGTH', '')
         if size and self._parser:
             size = int(size)
-            self._repr = self._parser(environ['wsgi.input'].read(size)) 
-            if environ['REQUEST_METHOD'] == "POST" and '_method' in self._repr and self._repr['_method'] in ['PUT', 'DELETE']:
-                environ['REQUEST_METHOD'] = self._repr['_method']
+            request.repr = self._parser(environ['wsgi.input'].read(size)) 
+            if environ['REQUEST_METHOD'] == "POST" and '_method' in request.repr and request.repr['_method'] in ['PUT', 'DELETE']:
+                environ['REQUEST_METHOD'] = request.repr['_method']
 
-        response = Collection.__call__(self, environ, start_response)
+        response = self._dispatch(environ, start_response, request)
 
         if response == None:
-            primary = self._model.primary_key.columns.keys()[0]
+            primary = self._primary
             view = environ['wsgiorg.routing_args'][1].get('view', '.')
-            template_file = os.path.join(view, self._function_name + "." + self._ext)
+            ext = self._ext
+            if self._negotiate:
+                ext = negotiate_extension(environ, ext)
+            template_file = os.path.join(view, request.function_name + "." + ext)
             method = environ.get('REQUEST_METHOD', 'GET')
-            if self._id:
-                if method == "POST" and "_method" in self._repr and self._repr["_method"] in ["PUT", "DELETE"]:
-                    method = self._repr["_method"]
-                    del self._repr["_method"]
+            if request.id:
+                if method == "POST" and "_method" in request.repr and request.repr["_method"] in ["PUT", "DELETE"]:
+                    method = request.repr["_method"]
+                    del request.repr["_method"]
+                start = time.time()
                 if method == 'GET':
-                    result = self._model.select(self._model.c[primary]==self._id).execute()
-                    row = result.fetchone()
-                    if None == row:
+                    (raw_etag, headers) = self._validators(environ, template_file)
+                    if headers == None:
+                        return http304(environ, start_response)
+                    cached = self._cached(environ, start_response, template_file, request.id)
+                    if cached != None:
+                        return cached
+                    columns = self._fields(primary, parse_qs(environ.get('QUERY_STRING', '')), None)
+                    data = self._row(request.id, columns)
+                    add_timing(environ, 'db', time.time() - start)
+                    if None == data:
                         return http404(environ, start_response)
-                    data = dict(zip(result.keys, row))
-                    return self._renderer(environ, start_response, template_file, {"row": data, "primary": primary}) 
+                    if raw_etag == None:
+                        raw_etag = repr(sorted(data.iteritems()))
+                    meta = columns or self._model.columns.keys()
+                    return self._renderer(environ, start_response, template_file, {"row": data, "primary": primary, "meta": meta}, headers, raw_etag=raw_etag) 
                 elif method == 'PUT':
-                    self._model.update(self._model.c[primary]==self._id).execute(self._repr)
-                    return http303(environ, start_response, self._id)
+                    self._statement('update', sorted(request.repr.keys())).execute(dict(request.repr, _pk=request.id))
+                    add_timing(environ, 'db', time.time() - start)
+                    self._changed(request.id, request.repr.get(primary, None))
+                    return http303(environ, start_response, request.id)
                 elif method == 'DELETE':
-                    self._model.delete(self._model.c[primary]==self._id).execute()
+                    self._statement('delete').execute(_pk=request.id)
+                    add_timing(environ, 'db', time.time() - start)
+                    self._changed(request.id)
                     return http303(environ, start_response, "./")
                 else:
                     print method
                     return http405(environ, start_response)
             else:
+                start = time.time()
                 if method == 'GET':
-                    result = self._model.select().execute()
-                    meta = self._model.columns.keys()
-                    data = [dict(zip(result.keys, row)) for row in result.fetchall()]
-                    return self._renderer(environ, start_response, template_file, {"data": data, "primary": primary, "meta": meta}) 
+                    (raw_etag, headers) = self._validators(environ, template_file)
+                    if headers == None:
+                        return http304(environ, start_response)
+                    cached = self._cached(environ, start_response, template_file, None)
+                    if cached != None:
+                        return cached
+                    query = parse_qs(environ.get('QUERY_STRING', ''))
+                    columns = self._fields(primary, query, self._list_fields)
+                    meta = columns or self._model.columns.keys()
+                    if self._page_size or 'limit' in query or 'after' in query or 'before' in query:
+                        (data, page) = self._page(primary, query, columns)
+                        add_timing(environ, 'db', time.time() - start)
+                        return self._renderer(environ, start_response, template_file, {"data": data, "primary": primary, "meta": meta, "page": page}, headers, raw_etag=raw_etag) 
+                    result = self._statement('all', columns).execute()
+                    if self._stream:
+                        environ[STREAM_KEY] = True
+                        data = self._rows(result)
+                    else:
+                        data = list(self._rows(result))
+                    add_timing(environ, 'db', time.time() - start)
+                    return self._renderer(environ, start_response, template_file, {"data": data, "primary": primary, "meta": meta}, headers, raw_etag=raw_etag) 
                 elif method == 'POST':
-                    results = self._model.insert(self._repr).execute()
-                    return http303(environ, start_response, str(results.last_inserted_ids()[0]))
+                    results = self._statement('insert', sorted(request.repr.keys())).execute(request.repr)
+                    id = results.last_inserted_ids()[0]
+                    add_timing(environ, 'db', time.time() - start)
+                    self._changed(id)
+                    return http303(environ, start_response, str(id))
         else:
             return response
 
+    def _fields(self, primary, query, default):
+        """Returns the names of the columns asked for by the 'fields'
+        query parameter, or default, along with the primary key, or
+        None if every column is wanted. The names are in the order of
+        the table's columns, whatever order they were asked for in, so
+        that each set of columns has only one Row class and statement."""
+        fields = default
+        if 'fields' in query:
+            fields = ",".join(query['fields']).split(",")
+        if not fields:
+            return None
+        chosen = set([name.strip() for name in fields])
+        chosen.add(primary)
+        return [name for name in self._model.columns.keys() if name in chosen]
+
+    def _select(self, columns, whereclause=None, **kwargs):
+        if columns == None:
+            return self._model.select(whereclause, **kwargs)
+        return select([self._model.c[name] for name in columns], whereclause, **kwargs)
+
+    def _statement(self, kind, columns=None, limit=None):
+        """Returns the compiled statement of the given kind, compiling
+        it the first time it is asked for, so that a request only has 
+        to bind its parameters. The primary key, when there is one, is
+        bound to '_pk'.
+
+        kind - 'id', 'all', 'first', 'after' or 'before' for a SELECT
+               of columns, or 'insert', 'update' or 'delete'. 
+        columns - The columns selected, or None for all of them, or
+               the columns set by an insert or update.
+        limit - The LIMIT of a 'first', 'after' or 'before' SELECT.
+        """
+        if columns != None:
+            columns = tuple(columns)
+        key = (kind, columns, limit)
+        statement = self._statements.get(key)
+        if statement == None:
+            column = self._model.c[self._primary]
+            if kind == 'id':
+                statement = self._select(columns, column == bindparam('_pk'))
+            elif kind == 'all':
+                statement = self._select(columns)
+            elif kind == 'first':
+                statement = self._select(columns, order_by=[asc(column)], limit=limit)
+            elif kind == 'after':
+                statement = self._select(columns, column > bindparam('_pk'), order_by=[asc(column)], limit=limit)
+            elif kind == 'before':
+                statement = self._select(columns, column < bindparam('_pk'), order_by=[desc(column)], limit=limit)
+            elif kind == 'insert':
+                statement = self._model.insert()
+            elif kind == 'update':
+                statement = self._model.update(column == bindparam('_pk'))
+            elif kind == 'delete':
+                statement = self._model.delete(column == bindparam('_pk'))
+            if kind in ('insert', 'update'):
+                statement = statement.compile(parameters=dict.fromkeys(columns))
+            else:
+                statement = statement.compile()
+            self._statements.put(key, statement)
+        return statement
+
+    def _row(self, id, columns):
+        """Returns the row with the primary key id, with only the given
+        columns if columns isn't None, or None if there is no such row.
+        The whole row is read through the row cache if there is one."""
+        cache = self._row_cache
+        key = None
+        if cache != None:
+            key = self._key(self._model.c[self._primary], id)
+        if key == None:
+            result = self._statement('id', columns).execute(_pk=id)
+            row = result.fetchone()
+            if row == None:
+                return None
+            return row_class(result.keys)(row)
+        table = self._model.name
+        (found, row) = cache.get(table, key)
+        if not found:
+            version = cache.version(table, key)
+            result = self._statement('id').execute(_pk=key)
+            row = result.fetchone()
+            if row != None:
+                row = row_class(result.keys)(row)
+            cache.put(table, key, row, version)
+        if row != None and columns != None:
+            row = row_class(columns)([row[name] for name in columns])
+        return row
+
+    def _page(self, primary, query, columns):
+        """Returns the rows of the page of the list asked for in query,
+        and the page dictionary that describes it."""
+        limit = self._page_size or self._max_page_size
+        try:
+            limit = int(query['limit'][0])
+        except (KeyError, ValueError):
+            pass
+        limit = max(1, min(limit, self._max_page_size))
+        column = self._model.c[primary]
+        before = self._key(column, query.get('before', [None])[0])
+        after = self._key(column, query.get('after', [None])[0])
+        if before != None:
+            result = self._statement('before', columns, limit + 1).execute(_pk=before)
+        elif after != None:
+            result = self._statement('after', columns, limit + 1).execute(_pk=after)
+        else:
+            result = self._statement('first', columns, limit + 1).execute()
+        Row = row_class(result.keys)
+        data = [Row(row) for row in result.fetchall()]
+        more = len(data) > limit
+        data = data[:limit]
+        if before != None:
+            data.reverse()
+            (earlier, later) = (more, True)
+        else:
+            (earlier, later) = (after != None, more)
+        page = {'limit': limit, 'next': None, 'prev': None}
+        extra = [('limit', limit)]
+        if 'fields' in query:
+            extra.append(('fields', ",".join(query['fields'])))
+        if data and later:
+            page['next'] = "?" + urllib.urlencode([('after', data[-1][primary])] + extra)
+        if data and earlier:
+            page['prev'] = "?" + urllib.urlencode([('before', data[0][primary])] + extra)
+        return (data, page)
+
+    def _key(self, column, value):
+        """Converts a key from the query string to the type of column,
+        returning None if it can't be."""
+        if value != None and isinstance(column.type, types.Integer):
+            try:
+                return int(value)
+            except ValueError:
+                return None
+        return value
+
+    def _rows(self, result):
+        """Yields the rows of result as Rows, fetching fetch_size rows 
+        at a time, and closes result when done."""
+        Row = row_class(result.keys)
+        try:
+            rows = result.fetchmany(self._fetch_size)
+            while rows:
+                for row in rows:
+                    yield Row(row)
+                rows = result.fetchmany(self._fetch_size)
+        finally:
+            result.close()
+
+    def _cached(self, environ, start_response, template_file, id):
+        """Returns the cached response for a GET if there is one, otherwise
+        asks render() to cache the response it renders."""
+        cache = self._render_cache
+        if cache == None or self._stream:
+            return None
+        tag = self._model.name
+        key = (template_file, tag, id, environ.get('QUERY_STRING', ''))
+        response = cache.get(key)
+        if response != None:
+            (status, headers, body) = response
+            if etag_matches(environ, dict(headers).get('etag', None)):
+                return http304(environ, start_response)
+            start_response(status, list(headers))
+            return [body]
+        environ[RENDER_CACHE_KEY] = (cache, key, tag, cache.generation(tag))
+        return None
+
+    def _validators(self, environ, template_file):
+        """Returns (raw_etag, headers) for a GET, where raw_etag is None
+        if table_validators is off, or (None, None) if the client's copy 
+        is current and a 304 should be sent."""
+        headers = {}
+        if self._negotiate:
+            headers['vary'] = 'Accept'
+        if not self._table_validators:
+            return (None, headers)
+        (version, last_modified) = table_version(self._model.name)
+        raw_etag = "%s:%s:%d" % (GENERATION, self._model.name, version)
+        if 'HTTP_IF_NONE_MATCH' in environ:
+            if etag_matches(environ, etag_from_raw_etag(raw_etag, template_file)):
+                return (None, None)
+        elif 'HTTP_IF_MODIFIED_SINCE' in environ:
+            since = parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+            if since != None and int(last_modified) <= mktime_tz(since):
+                return (None, None)
+        headers['last-modified'] = formatdate(last_modified, usegmt=True)
+        return (raw_etag, headers)
+
+    def _changed(self, *ids):
+        """Records a write to the rows of the table with the given 
+        primary keys, None for a key that isn't known."""
+        table_changed(self._model.name)
+        if self._render_cache != None:
+            self._render_cache.invalidate(self._model.name)
+        if self._row_cache != None:
+            column = self._model.c[self._primary]
+            for id in ids:
+                key = self._key(column, id)
+                if key != None:
+                    self._row_cache.invalidate(self._model.name, key)
@@ -0,0 +1,115 @@
+"""
+JSON Stream
+
+Encodes JSON with the fastest encoder installed, chosen once at
+import time: simplejson if its C speedups are built, otherwise
+the standard library json module, otherwise simplejson. The name
+of the module chosen is in ENCODER.
+
+iterencode() yields a document a piece at a time, so that a list
+of thousands of rows, or a generator of rows read lazily from the
+database, is never held as one string::
+
+    from robaccia.jsonstream import iterencode
+
+    for chunk in iterencode({"data": rows, "primary": "id"}):
+        write(chunk)
+
+Each row is encoded with a single call to the encoder, or for a
+robaccia.rows.Row, by filling in a format made once for its 
+columns. Rows are encoded as objects at any depth in the document,
+and any other iterable found in it, such as a generator, is 
+encoded as a list.
+"""
+
+try:
+    import simplejson._speedups
+    import simplejson as json
+except ImportError:
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
+
+from rows import Row
+
+ENCODER = json.__name__
+
+def _list_iterable(o):
+    if hasattr(o, '__iter__'):
+        return list(o)
+    raise TypeError("%r is not JSON serializable" % o)
+
+def _plain(o):
+    """Returns o with the Rows in it, at any depth, made dicts."""
+    if isinstance(o, Row):
+        return o.for_json()
+    if isinstance(o, dict):
+        return dict([(key, _plain(value)) for (key, value) in o.iteritems()])
+    if isinstance(o, (list, tuple)):
+        return [_plain(value) for value in o]
+    return o
+
+class _RowsEncoder(json.JSONEncoder):
+    """An encoder for the json modules that would encode a Row, 
+    being a tuple, as a list."""
+    def iterencode(self, o, *args, **kwargs):
+        return json.JSONEncoder.iterencode(self, _plain(o), *args, **kwargs)
+
+try:
+    _encoder = json.JSONEncoder(default=_list_iterable, for_json=True)
+except TypeError:
+    _encoder = _RowsEncoder(default=lambda o: _plain(_list_iterable(o)))
+
+_encode = _encoder.encode
+_row_formats = {}
+
+def _row_format(keys):
+    format = _row_formats.get(keys, None)
+    if format == None:
+        format = "{%s}" % ", ".join([_encode(key).replace("%", "%%") + ": %s" for key in keys])
+        _row_formats[keys] = format
+    return format
+
+def dumps(obj):
+    """Returns the JSON text of obj, encoding a Row as an object."""
+    if isinstance(obj, Row):
+        return _row_format(obj._keys) % tuple([_encode(value) for value in obj.itervalues()])
+    return _encode(obj)
+
+loads = json.loads
+
+def iterencode(obj, depth=2):
+    """Yields the JSON text of obj a piece at a time. The members of
+    dicts and the items of lists and other iterables are yielded
+    one by one down to depth levels, below which each value is
+    encoded in one piece."""
+    if isinstance(obj, Row):
+        yield dumps(obj)
+    elif depth and isinstance(obj, dict):
+        yield '{'
+        first = True
+        for (key, value) in obj.iteritems():
+            if first:
+                first = False
+            else:
+                yield ', '
+            if not isinstance(key, basestring):
+                key = str(key)
+            yield dumps(key)
+            yield ': '
+            for chunk in iterencode(value, depth - 1):
+                yield chunk
+        yield '}'
+    elif depth and hasattr(obj, '__iter__') and not isinstance(obj, basestring):
+        yield '['
+        first = True
+        for item in obj:
+            if first:
+                first = False
+                yield dumps(item)
+            else:
+                yield ', ' + dumps(item)
+        yield ']'
+    else:
+        yield dumps(obj)
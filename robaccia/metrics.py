@@ -0,0 +1,182 @@
+"""
+Metrics
+
+Per-route request counts, response status counts and latency
+histograms. A Dispatcher given a Metrics instance records, for
+every request, the route template that matched, the request
+method, the response status and how long was spent in each of
+these phases:
+
++---------+------------------------------------------------------+
+|Phase    |Time spent                                            |
++=========+======================================================+
+|routing  |finding the route that matches the request            |
++---------+------------------------------------------------------+
+|handler  |in the application, less the db and render time       |
++---------+------------------------------------------------------+
+|db       |executing queries and fetching rows                   |
++---------+------------------------------------------------------+
+|render   |rendering templates                                   |
++---------+------------------------------------------------------+
+
+The db and render phases are reported by calling add_timing(),
+which robaccia.render and DefaultModelCollection already do.
+A request is recorded when the server closes its response, so the
+handler time includes the time taken to produce and send the body.
+Request methods other than those in METHODS are recorded as 'OTHER'.
+
+The numbers are available in-process from snapshot(), and
+as text in the Prometheus exposition format by adding the
+``app`` of a Metrics instance to a Dispatcher::
+
+    from robaccia.metrics import Metrics
+
+    metrics = Metrics()
+    urls = Dispatcher(metrics=metrics)
+    urls.add('/_metrics', GET=metrics.app)
+    urls.add('/{view:alnum}/[{id:unreserved}][;{noun:unreserved}]', deferred_collection)
+"""
+
+import threading
+from bisect import bisect_left
+
+# The upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ('routing', 'handler', 'db', 'render')
+
+# The request methods recorded by name, any other is recorded as 'OTHER'
+# so that clients can't add labels at will.
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
+
+# The environ key that the phase timings of a request are collected in.
+TIMINGS_KEY = 'robaccia.timings'
+
+def add_timing(environ, phase, seconds):
+    """Adds seconds to the time spent in phase by the current
+    request. Does nothing if the request is not being measured."""
+    timings = environ.get(TIMINGS_KEY, None)
+    if timings != None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+class Histogram(object):
+    __slots__ = ['counts', 'count', 'sum']
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """Returns a list of (upper bound, count) pairs, where the
+        count includes every observation up to the upper bound."""
+        result = []
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class RouteMetrics(object):
+    __slots__ = ['requests', 'statuses', 'latency']
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.latency = dict([(phase, Histogram()) for phase in PHASES])
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, method, status, timings):
+        """Records one request. The timings are a dictionary 
+        that maps phase names to seconds."""
+        if method not in METHODS:
+            method = 'OTHER'
+        key = (route, method)
+        self._lock.acquire()
+        try:
+            metrics = self._routes.get(key, None)
+            if metrics == None:
+                metrics = self._routes[key] = RouteMetrics()
+            metrics.requests += 1
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            for phase, seconds in timings.iteritems():
+                if phase in metrics.latency:
+                    metrics.latency[phase].observe(seconds)
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Returns a dictionary that maps (route, method) to a 
+        dictionary of the requests, statuses and latency for that
+        route. The latency maps each phase to its count, sum and 
+        cumulative buckets."""
+        self._lock.acquire()
+        try:
+            result = {}
+            for key, metrics in self._routes.iteritems():
+                result[key] = {
+                    'requests': metrics.requests,
+                    'statuses': metrics.statuses.copy(),
+                    'latency': dict([(phase, {
+                        'count': histogram.count, 
+                        'sum': histogram.sum, 
+                        'buckets': histogram.cumulative()
+                        }) for phase, histogram in metrics.latency.iteritems()])
+                    }
+            return result
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._routes = {}
+        finally:
+            self._lock.release()
+
+    def exposition(self):
+        """Returns all the metrics as text in the Prometheus exposition format."""
+        requests = ["# TYPE robaccia_requests_total counter"]
+        responses = ["# TYPE robaccia_responses_total counter"]
+        latency = ["# TYPE robaccia_latency_seconds histogram"]
+        snapshot = self.snapshot()
+        keys = snapshot.keys()
+        keys.sort()
+        for route, method in keys:
+            metrics = snapshot[(route, method)]
+            labels = 'route="%s",method="%s"' % (_label(route), _label(method))
+            requests.append("robaccia_requests_total{%s} %d" % (labels, metrics['requests']))
+            statuses = metrics['statuses'].items()
+            statuses.sort()
+            for status, count in statuses:
+                responses.append('robaccia_responses_total{%s,status="%s"} %d' % (labels, _label(status), count))
+            for phase in PHASES:
+                histogram = metrics['latency'][phase]
+                phase_labels = '%s,phase="%s"' % (labels, phase)
+                for bound, count in histogram['buckets']:
+                    latency.append('robaccia_latency_seconds_bucket{%s,le="%s"} %d' % (phase_labels, bound, count))
+                latency.append("robaccia_latency_seconds_sum{%s} %f" % (phase_labels, histogram['sum']))
+                latency.append("robaccia_latency_seconds_count{%s} %d" % (phase_labels, histogram['count']))
+        return "\n".join(requests + responses + latency) + "\n"
+
+    def app(self, environ, start_response):
+        """A WSGI application that serves the exposition()."""
+        start_response("200 Ok", [('Content-Type', 'text/plain; version=0.0.4')])
+        return [self.exposition()]
@@ -12,6 +12,7 @@ Contents:
     - quality():           Determines the quality ('q') of a mime-type when compared against a list of media-ranges.
     - quality_parsed():    Just like quality() except the second parameter must be pre-parsed.
     - best_match():        Choose the mime-type with the highest quality ('q') from a list of candidates. 
+    - Negotiator:          Like best_match() for a fixed list of candidates, remembering the results for each header.
 """
 
 __version__ = "0.1.1"
@@ -19,6 +20,8 @@ __author__ = 'Joe Gregorio'
 __email__ = "joe@bitworking.org"
 __credits__ = ""
 
+from cache import LRUCache
+
 def parse_mime_type(mime_type):
     """Carves up a mime_type and returns a tuple of the
        (type, subtype, params) where 'params' is a dictionary
@@ -109,6 +112,70 @@ def best_match(supported, header):
     weighted_matches.sort()
     return weighted_matches[-1][0] and weighted_matches[-1][1] or ''
 
+class Negotiator(object):
+    """Chooses from a fixed list of supported mime-types just as 
+    best_match() does, but parses the supported mime-types once, 
+    parses each q value in a header once, and remembers the result
+    for the last cache_size distinct headers.
+
+    >>> n = Negotiator(['application/xbel+xml', 'text/xml'])
+    >>> n.best_match('text/*;q=0.5,*/*; q=0.1')
+    'text/xml'
+    """
+    def __init__(self, supported, cache_size=100):
+        self.supported = list(supported)
+        self._targets = []
+        for mime_type in self.supported:
+            (type, subtype, params) = parse_media_range(mime_type)
+            params = [(key, value) for (key, value) in params.iteritems() if key != 'q']
+            self._targets.append((type, subtype, params, mime_type))
+        self._cache = LRUCache(cache_size)
+
+    def _parse(self, header):
+        """Parses header, skipping any media ranges that don't parse."""
+        ranges = []
+        for range in header.split(","):
+            try:
+                (type, subtype, params) = parse_media_range(range)
+                ranges.append((type, subtype, params, float(params['q'])))
+            except ValueError:
+                pass
+        return ranges
+
+    def qualities(self, header):
+        """Returns a list of (quality, mime_type) pairs, one for 
+        each of the supported mime-types, in the order given."""
+        weighted = self._cache.get(header)
+        if weighted == None:
+            ranges = self._parse(header)
+            weighted = []
+            for (target_type, target_subtype, target_params, mime_type) in self._targets:
+                best_fitness = -1
+                best_fit_q = 0.0
+                for (type, subtype, params, q) in ranges:
+                    if (type == target_type or type == '*' or target_type == '*') and \
+                            (subtype == target_subtype or subtype == '*' or target_subtype == '*'):
+                        fitness = (type == target_type) and 100 or 0
+                        fitness += (subtype == target_subtype) and 10 or 0
+                        for (key, value) in target_params:
+                            if params.get(key, None) == value:
+                                fitness += 1
+                        if fitness > best_fitness:
+                            best_fitness = fitness
+                            best_fit_q = q
+                weighted.append((best_fit_q, mime_type))
+            self._cache.put(header, weighted)
+        return weighted
+
+    def best_match(self, header):
+        """Returns the supported mime-type that best matches header,
+        or '' if none of them are acceptable."""
+        weighted = self.qualities(header)
+        if not weighted:
+            return ''
+        best = max(weighted)
+        return best[0] and best[1] or ''
+
 if __name__ == "__main__":
     import unittest
 
@@ -157,6 +224,17 @@ if __name__ == "__main__":
             # match using a wildcard for both requested and supported 
             self.assertEqual(best_match(mime_types_supported, 'image/*'), 'image/*')
 
+        def test_negotiator(self):
+            supported = ['application/xbel+xml', 'application/xml', 'text/xml', 'text/html;level=1']
+            negotiator = Negotiator(supported)
+            for header in ['application/xbel+xml', 'application/xml; q=1', 'application/*; q=1', '*/*',
+                    'text/*;q=0.5,*/*; q=0.1', 'text/html,application/atom+xml; q=0.9', 'text/html;level=1',
+                    "text/*;q=0.3, text/html;q=0.7, text/html;level=1, text/html;level=2;q=0.4, */*;q=0.5"]:
+                self.assertEqual(best_match(supported, header), negotiator.best_match(header))
+                self.assertEqual(best_match(supported, header), negotiator.best_match(header))
+            self.assertEqual('', negotiator.best_match(''))
+            self.assertEqual('text/xml', negotiator.best_match('text/xml, garbage'))
+
     unittest.main() 
 
 
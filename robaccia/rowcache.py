@@ -0,0 +1,198 @@
+"""
+Row Cache
+
+A read-through cache of table rows, keyed by table name and
+primary key, that DefaultModelCollection consults before
+querying the database for a single row::
+
+    from robaccia.rowcache import RowCache
+
+    app = DefaultModelCollection('html', render, form_parser, table,
+            row_cache=RowCache(ttl=300, negative_ttl=30))
+
+Ids that are not in the table are cached too, for negative_ttl
+seconds, so repeated requests for missing rows get their 404
+without a query. The collection drops a row from the cache when
+it is updated or deleted, and drops the negative entry for an id
+when a row is created with that id.
+
+Each cached row is stored along with a version, and only counts as
+cached while that is the version kept for its key, which every
+invalidation replaces. A row read from the database before an
+invalidation is stored with the version from before it, so it is
+never served, whichever process read it.
+
+The rows are kept by a backend. LocalBackend, the default, keeps
+them in this process, in an LRU cache bounded by the number of
+rows and by their total size in bytes. MemcacheBackend keeps them
+in memcached, so the processes of a deployment share them and a
+write in one process drops the row for all of them::
+
+    import memcache
+    from robaccia.rowcache import RowCache, MemcacheBackend
+
+    cache = RowCache(MemcacheBackend(memcache.Client(['127.0.0.1:11211'])))
+
+A backend has get(key), set(key, value, ttl), add(key, value, ttl)
+and delete(key), where keys and values are strings, get() returns
+None for a key it doesn't have, and add() only stores a value for
+a key that doesn't have one, returning whether it did. Rows are
+stored as JSON, so rows with values JSON can't hold, such as
+dates, aren't cached.
+"""
+
+import threading
+import time
+import urllib
+import uuid
+from cache import RenderCache
+from rows import row_class
+from jsonstream import dumps, loads
+
+class LocalBackend(RenderCache):
+    """Keeps rows in this process, discarding the least recently
+    used when there are more than size of them or they take more
+    than max_bytes."""
+
+    def __init__(self, size=10000, max_bytes=16*1024*1024):
+        RenderCache.__init__(self, size, max_bytes, ttl=None)
+        self._write_lock = threading.Lock()
+
+    def set(self, key, value, ttl=None):
+        self._write_lock.acquire()
+        try:
+            self._set(key, value, ttl)
+        finally:
+            self._write_lock.release()
+
+    def add(self, key, value, ttl=None):
+        self._write_lock.acquire()
+        try:
+            if self.get(key) != None:
+                return False
+            return self._set(key, value, ttl)
+        finally:
+            self._write_lock.release()
+
+    def _set(self, key, value, ttl):
+        expires = None
+        if ttl:
+            expires = time.time() + ttl
+        return self._store(key, value, len(value), expires, None, None)
+
+
+class MemcacheBackend(object):
+    """Keeps rows in memcached through client, a memcache.Client or
+    anything with the same get(), set(), add() and delete() methods.
+    The keys are prefixed with prefix, so that several deployments
+    can share one memcached."""
+
+    def __init__(self, client, prefix='robaccia:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, int(ttl or 0))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.add(self.prefix + key, value, int(ttl or 0)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class RowCache(object):
+
+    def __init__(self, backend=None, ttl=300, negative_ttl=30):
+        """
+backend - Where the rows are kept, a LocalBackend if None.
+ttl - The number of seconds a row is kept, or None to keep rows
+      until they are evicted or invalidated.
+negative_ttl - The number of seconds that an id is remembered as
+      missing, 0 to not remember missing ids.
+        """
+        if backend == None:
+            backend = LocalBackend()
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _key(self, table, id):
+        if isinstance(id, unicode):
+            id = id.encode('utf-8')
+        return "%s:%s" % (table, urllib.quote(str(id), safe=''))
+
+    def get(self, table, id):
+        """Returns (True, row) if the row of table with primary key id
+        is cached, where row is None if there is no such row, and
+        (False, None) if it isn't cached."""
+        key = self._key(table, id)
+        value = self.backend.get(key)
+        if value != None:
+            try:
+                (version, keys, values) = loads(value)
+            except (ValueError, TypeError):
+                version = None
+            if version != None and version == self.backend.get(key + ":version"):
+                if keys == None:
+                    self.negative_hits += 1
+                    return (True, None)
+                self.hits += 1
+                return (True, row_class(keys)(values))
+        self.misses += 1
+        return (False, None)
+
+    def version(self, table, id):
+        """Returns the version of the row of table with primary key id,
+        to be read before the row is read from the database and passed
+        to put()."""
+        key = self._key(table, id) + ":version"
+        version = self.backend.get(key)
+        if version == None:
+            version = uuid.uuid4().hex
+            if not self.backend.add(key, version, self.ttl):
+                # An invalidation got there first.
+                version = self.backend.get(key)
+        return version
+
+    def put(self, table, id, row, version):
+        """Stores row, a robaccia.rows.Row or None if there is no such
+        row, for the primary key id of table, with the version read
+        by version() before the row was read."""
+        if version == None:
+            return
+        if row == None:
+            ttl = self.negative_ttl
+            if not ttl:
+                return
+            value = dumps([version, None, None])
+        else:
+            ttl = self.ttl
+            try:
+                value = dumps([version, row._keys, tuple(row.itervalues())])
+            except TypeError:
+                return
+        self.backend.set(self._key(table, id), value, ttl)
+
+    def invalidate(self, table, id):
+        """Drops the row of table with primary key id, and any copy of
+        it that is being read from the database."""
+        key = self._key(table, id)
+        self.backend.set(key + ":version", uuid.uuid4().hex, self.ttl)
+        self.backend.delete(key)
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses
+        }
+        if hasattr(self.backend, 'stats'):
+            stats['backend'] = self.backend.stats()
+        return stats
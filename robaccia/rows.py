@@ -0,0 +1,119 @@
+"""
+Rows
+
+A compact, read-only row type for query results. Each row is a
+tuple of the column values, with no dictionary of its own; the
+column names and their positions are kept once, on a class that
+is made the first time a set of columns is seen::
+
+    from robaccia.rows import row_class
+
+    result = table.select().execute()
+    Row = row_class(result.keys)
+    rows = [Row(row) for row in result.fetchall()]
+
+A row behaves like a read-only dictionary keyed by column name,
+so templates can use row['id'], row.get('id') and
+row.iteritems(), and a row compares equal to the dictionary with
+the same keys and values. Iterating over a row, as with a
+dictionary, gives the column names. JSON encoders that know the
+for_json() hook, such as simplejson, encode a row as an object.
+"""
+
+import threading
+from itertools import izip
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Before Python 2.7 the columns of a row encoded by for_json()
+    # come out in no particular order.
+    OrderedDict = dict
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+def row_class(keys):
+    """Returns the Row class for this sequence of column names."""
+    keys = tuple(keys)
+    cls = _classes.get(keys, None)
+    if cls == None:
+        _classes_lock.acquire()
+        try:
+            cls = _classes.get(keys, None)
+            if cls == None:
+                index = dict([(key, i) for (i, key) in enumerate(keys)])
+                cls = _classes[keys] = type('Row', (Row,), {'__slots__': (), '_keys': keys, '_index': index})
+        finally:
+            _classes_lock.release()
+    return cls
+
+
+_missing = object()
+
+class Row(tuple):
+    __slots__ = ()
+    _keys = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        i = self._index.get(key, None)
+        if i == None:
+            return default
+        return tuple.__getitem__(self, i)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self._keys)
+
+    def itervalues(self):
+        return tuple.__iter__(self)
+
+    def values(self):
+        return list(tuple.__iter__(self))
+
+    def iteritems(self):
+        return izip(self._keys, tuple.__iter__(self))
+
+    def items(self):
+        return zip(self._keys, tuple.__iter__(self))
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def for_json(self):
+        return OrderedDict(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._keys == other._keys and tuple.__eq__(self, other)
+        if isinstance(other, dict):
+            if len(other) != len(self._keys):
+                return False
+            for (key, value) in self.iteritems():
+                if other.get(key, _missing) != value:
+                    return False
+            return True
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = tuple.__hash__
+
+    def __repr__(self):
+        return "{%s}" % ", ".join(["%r: %r" % item for item in self.iteritems()])
@@ -1,6 +1,11 @@
 from robaccia.wsgidispatcher import Dispatcher
-from robaccia import deferred_collection
+from robaccia import deferred_collection, view_registry, template_index, TEMPLATE_DIRS
 
 app = Dispatcher()
 app.add('/{view:alnum}/[{id:unreserved}][;{noun:unreserved}]', deferred_collection)
 
+# Import every view now so that no request waits on an import.
+view_registry.preload()
+
+# Index the templates now so that finding one doesn't touch the disk.
+template_index(TEMPLATE_DIRS)
@@ -114,6 +114,7 @@ And this class can be easily hooked up to wsgidispatcher::
 
 import re
 import cgi
+import threading
 from logging import info, error
 
 COLL_MAP = {
@@ -127,18 +128,127 @@ ENTRY_MAP = {
     'DELETE': 'delete'
 }
 
+# The environ key that the CollectionRequest of a request is stored under.
+REQUEST_KEY = 'wsgicollection.request'
+
+class CollectionRequest(object):
+    """The per-request state of a Collection: the 'id' and 'noun'
+    from the URI, the name of the member function the request 
+    was dispatched to, and the request representation as a dict."""
+    __slots__ = ['id', 'noun', 'function_name', 'repr']
+
+    def __init__(self):
+        self.id = ""
+        self.noun = ""
+        self.function_name = ""
+        self.repr = {}
+
+
+def request_property(name):
+    """A property that reads and writes the named attribute 
+    of the CollectionRequest being handled by the current thread."""
+    def get(self):
+        return getattr(self._current(), name)
+    def set(self, value):
+        setattr(self._current(), name, value)
+    return property(get, set)
+
+
+def handler_table(cls):
+    """Returns a tuple of two dictionaries for a Collection class. 
+    The first maps (method, noun, has_id) to the name of the member 
+    function that handles such a request, where noun is None for the
+    requests in COLL_MAP and ENTRY_MAP. The second maps (noun, has_id) 
+    to the value of an Allow header listing the methods handled."""
+    handlers = {}
+    for name in dir(cls):
+        if name.startswith("_") or not callable(getattr(cls, name, None)):
+            continue
+        for method, function_name in COLL_MAP.iteritems():
+            if name == function_name:
+                handlers[(method, None, False)] = name
+        for method, function_name in ENTRY_MAP.iteritems():
+            if name == function_name:
+                handlers[(method, None, True)] = name
+        if name.find("_") > 0:
+            method, noun = name.split("_", 1)
+            handlers[(method.upper(), noun, False)] = name
+            handlers[(method.upper(), noun, True)] = name
+    allowed = {}
+    for method, noun, has_id in handlers:
+        allowed.setdefault((noun, has_id), []).append(method)
+    for key, methods in allowed.iteritems():
+        methods.sort()
+        allowed[key] = ", ".join(methods)
+    return (handlers, allowed)
+
+
+class CollectionType(type):
+    """Builds the handler table of every Collection class
+    as the class is created, so that dispatching a request 
+    is a dictionary lookup."""
+    def __init__(cls, name, bases, dict):
+        type.__init__(cls, name, bases, dict)
+        cls._handlers, cls._allowed = handler_table(cls)
+
+
 class Collection(object):
     """
+    Requests are dispatched through a table built when the class is
+    created, which also gives the methods allowed for any URI, so a 
+    request with a method that is not handled gets a 405 response with
+    an Allow header. Member functions added to the class after it is
+    created are not dispatched to.
+
+    A single Collection instance can handle requests from many
+    threads at once. The state of each request is kept in a
+    CollectionRequest, which is stored in environ['wsgicollection.request']
+    and is also available from self._id, self._noun and 
+    self._function_name to the thread handling the request while
+    it is being handled.
     """
+    __metaclass__ = CollectionType
+
     def __init__(self):
         self._id = "" 
         self._noun = ""
         self._function_name = ""
 
+    _id = request_property('id')
+    _noun = request_property('noun')
+    _function_name = request_property('function_name')
+
+    def _local(self):
+        local = self.__dict__.get('_threadlocal', None)
+        if local == None:
+            local = self.__dict__.setdefault('_threadlocal', threading.local())
+        return local
+
+    def _current(self):
+        local = self._local()
+        request = getattr(local, 'request', None)
+        if request == None:
+            request = local.request = CollectionRequest()
+        return request
+
     def __call__(self, environ, start_response):
-        self._id = "" 
-        self._noun = ""
-        self._function_name = ""
+        return self._dispatch(environ, start_response, CollectionRequest())
+
+    def _dispatch(self, environ, start_response, request):
+        """Dispatches the request to a member function, using 
+        request to hold the state of the request."""
+        environ[REQUEST_KEY] = request
+        local = self._local()
+        previous = getattr(local, 'request', None)
+        local.request = request
+        try:
+            return self._handle(environ, start_response, request)
+        finally:
+            # Nothing of the request, such as its body, is kept on
+            # the thread once the outermost call returns.
+            local.request = previous
+
+    def _handle(self, environ, start_response, request):
         if 'wsgiorg.routing_args' in environ:
             url_vars = environ['wsgiorg.routing_args'][1]
         elif 'selector.vars' in environ:
@@ -148,19 +258,18 @@ class Collection(object):
             #error("Environment variables for wsgicollection.Collection not provided via WSGI. %s" % str(environ))
             return ['Environment variables for wsgicollection.Collection not provided via WSGI.']
 
-        self._id = url_vars.get('id', '')
-        self._noun = url_vars.get('noun', '')
-        method = environ['REQUEST_METHOD']
-        self._function_name = "%s_%s" % (method.lower(), self._noun)
-        if not self._noun:
-            method_map = self._id and ENTRY_MAP or COLL_MAP
-            self._function_name = method_map.get(method, '') 
-
-        if self._function_name and not self._function_name.startswith("_") and self._function_name in dir(self):
-            return getattr(self, self._function_name)(environ, start_response)
-        else:
-            start_response("404 Not Found", [("Content-Type", "text/plain")])
-            return ["Resource not found."]
-
-
+        request.id = url_vars.get('id', '')
+        request.noun = url_vars.get('noun', '')
+        noun = request.noun or None
+        has_id = bool(request.id)
+        function_name = self._handlers.get((environ['REQUEST_METHOD'], noun, has_id), None)
+        if function_name:
+            request.function_name = function_name
+            return getattr(self, function_name)(environ, start_response)
+        allowed = self._allowed.get((noun, has_id), None)
+        if allowed:
+            start_response("405 Method Not Allowed", [("Content-Type", "text/plain"), ("Allow", allowed)])
+            return ["Method not allowed."]
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return ["Resource not found."]
 
@@ -63,11 +63,20 @@ Some things to note:
 
 * Patterns are matched in the order in which they are added to the Dispatcher.
 * First match wins
+* Plain string patterns are kept in a table keyed on the path and method
+  and are found without trying any template or regular expression,
+  unless a template added before them could also match the path.
+* Patterns are indexed by the literal path segments they start with, so
+  only the patterns that could possibly match a request are tried, and
+  the cost of a lookup depends on the depth of the path and not on the
+  number of patterns added.
 * You can define you own new ranges, or over-ride the built in ranges. 
 * You can provide one application for every method, or you can
   provide a single application that will response to every method used.
 * If no matches are found a 404 message is generated. 
 * You can provide your own custom 404 handler.
+* You can mount another Dispatcher, or any WSGI application, below a
+  path prefix with ``mount()``.
 * Does not use setuptools
 * No external dependencies
 
@@ -202,17 +211,26 @@ __all__ = [
     "InvalidArgumentError",   
     "InvalidTemplateError",
     "Dispatcher",
-    "template2regex"
+    "template2regex",
+    "template_prefix",
+    "regex_prefix"
 ]
     
 import re
+import time
 import logging
+from cache import LRUCache
+from metrics import TIMINGS_KEY
 
 logger = logging.getLogger("robaccia.request")
 
 NOMATCH = -1
 template_splitter = re.compile("([\[\]\{\}])")
 
+# Characters that have a special meaning in a regular expression. The literal
+# prefix of a pattern ends at the first one of these.
+REGEX_SPECIAL = ".^$*+?{}[]\\|()"
+
 class DispatcherException(Exception): pass
 class DuplicateArgumentError(DispatcherException): pass 
 class InvalidArgumentError(DispatcherException): pass
@@ -314,6 +332,88 @@ def template2regex(template, ranges=None):
     return "".join(result)
 
 
+def regex_prefix(regex):
+    """
+    Returns the leading part of a regular expression that 
+    can only match itself, for example the prefix of
+    ``^/comments/(\d+)$`` is ``/comments/``. A character 
+    followed by an optional quantifier is not part of the prefix.
+    Regular expressions that contain alternations have
+    no prefix.
+    """
+    if regex.find("|") > -1:
+        return ""
+    if regex.startswith("^"):
+        regex = regex[1:]
+    prefix = []
+    for c in regex:
+        if c in REGEX_SPECIAL:
+            if c in "*?{" and prefix:
+                prefix.pop()
+            break
+        prefix.append(c)
+    return "".join(prefix)
+
+def template_prefix(template):
+    """
+    Returns the leading part of a template that contains
+    no template markup, for example the prefix of
+    ``/service/[{id}]`` is ``/service/``.
+    """
+    for i, c in enumerate(template):
+        if c in "{[|":
+            return regex_prefix(template[:i])
+    return regex_prefix(template)
+
+
+class RouteNode(object):
+    __slots__ = ['children', 'routes']
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []
+
+
+class RouteIndex(object):
+    """
+    A trie of literal path segments. Each predicate is stored at 
+    the node reached by walking the complete segments of its 
+    literal prefix, i.e. the ones that are followed by a '/'. 
+    A request path can only be matched by the predicates stored 
+    along the walk of its own segments, so only those are 
+    returned as candidates, in the order they were added.
+    """
+    def __init__(self):
+        self.root = RouteNode()
+
+    def add(self, prefix, position, predicate):
+        node = self.root
+        for segment in prefix.split("/")[:-1]:
+            child = node.children.get(segment, None)
+            if child == None:
+                child = node.children[segment] = RouteNode()
+            node = child
+        node.routes.append((position, predicate))
+
+    def candidates(self, path):
+        node = self.root
+        found = node.routes
+        merged = False
+        for segment in path.split("/")[:-1]:
+            node = node.children.get(segment, None)
+            if node == None:
+                break
+            if node.routes:
+                if found:
+                    found = found + node.routes
+                    merged = True
+                else:
+                    found = node.routes
+        if merged:
+            found.sort()
+        return found
+
+
 class TemplatePredicate(object):
     """The presence of [], |, or {} indicates 
     match is a template and not just a plain string match."""
@@ -321,84 +421,165 @@ class TemplatePredicate(object):
         self.path = path
         self.appdict = appdict
         self.ranges = ranges
+        self.route = path.rstrip("|")
 
         # We lazy eval the paths, only parsing regex's and such until we are called on to make a match.
         self.isparsed = False
 
         # Either this is a template, or a pure string match
-        self.istemplate = False
+        self.istemplate = path.find("{") > -1 or path.find("[") > -1 or (len(path) and path[-1] == '|')
 
-    def __call__(self, environ, start_response):
+        if self.istemplate:
+            self.prefix = template_prefix(path)
+        else:
+            self.prefix = path
+
+    def compile(self):
+        if self.istemplate:
+            regex = template2regex(self.path, self.ranges)
+            try:
+                self.regex= re.compile(regex)
+            except re.error:
+                raise InvalidTemplateError("Invalid Template %s" % self.path)
+        self.isparsed = True
+
+    def match(self, request_path, method):
+        """Returns a tuple of (app, end, groups, groupdict) if the 
+        request path and method match, otherwise None. The tuple
+        only depends on the path and method, and is passed back 
+        into dispatch() to hand the request on to the app."""
         if not self.isparsed:
-            if self.path.find("{") > -1 or self.path.find("[") > -1 or (len(self.path) and self.path[-1] == '|'):
-                regex = template2regex(self.path, self.ranges)
-                try:
-                    self.regex= re.compile(regex)
-                except:
-                    raise Exception("Invalid Template")
-                self.istemplate = True
-                self.isparsed = True
+            self.compile()
+        if method in self.appdict or "_ANY_" in self.appdict:
+            if not self.istemplate:
+                if self.path == request_path:
+                    return (self.appdict.get(method, self.appdict.get('_ANY_', None)), len(request_path), (), {})
             else:
-                self.isparsed = True
-        request_path = environ.get('PATH_INFO', '')
-        method = environ.get('REQUEST_METHOD', 'GET')
+                match = self.regex.match(request_path)
+                if match:
+                    return (self.appdict.get(method, self.appdict.get('_ANY_', None)), match.end(), (), match.groupdict())
+        return None
+
+    def dispatch(self, environ, start_response, match):
+        app, end, groups, groupdict = match
         if not self.istemplate:
-            if self.path == request_path:
-                if method in self.appdict or "_ANY_" in self.appdict:
-                    environ['wsgiorg.routing_args'] = ([], {})
-                    return self.appdict.get(method, self.appdict.get('_ANY_', None))(environ, start_response)
+            environ['wsgiorg.routing_args'] = ([], {})
         else:
             script_name = environ.get('SCRIPT_NAME', '')
-            match = self.regex.match(request_path)
-            if match:
-                if method in self.appdict or "_ANY_" in self.appdict:
-                    extra_request_path = request_path[match.end():]
-                    pos, named = environ.get('wsgiorg.routing_args', ((), {}))
-                    new_named = named.copy()
-                    new_named.update(match.groupdict())
-                    environ['wsgiorg.routing_args'] = (pos, new_named)
-                    environ['SCRIPT_NAME'] = script_name + request_path[:match.end()]
-                    environ['PATH_INFO'] = extra_request_path
-                    return self.appdict.get(method, self.appdict.get('_ANY_', None))(environ, start_response)
-        return NOMATCH
+            request_path = environ.get('PATH_INFO', '')
+            pos, named = environ.get('wsgiorg.routing_args', ((), {}))
+            new_named = named.copy()
+            new_named.update(groupdict)
+            environ['wsgiorg.routing_args'] = (pos, new_named)
+            environ['SCRIPT_NAME'] = script_name + request_path[:end]
+            environ['PATH_INFO'] = request_path[end:]
+        return app(environ, start_response)
+
+    def __call__(self, environ, start_response):
+        match = self.match(environ.get('PATH_INFO', ''), environ.get('REQUEST_METHOD', 'GET'))
+        if match == None:
+            return NOMATCH
+        return self.dispatch(environ, start_response, match)
 
 
 class RegexPredicate(object):
     def __init__(self, regex, appdict, ranges):
         self.regexsrc = regex 
+        self.route = regex
         self.isparsed = False
         self.appdict = appdict
+        self.prefix = regex_prefix(regex)
 
-    def __call__(self, environ, start_response):
-        if not self.isparsed:
+    def compile(self):
+        try:
             self.regex = re.compile(self.regexsrc)
+        except re.error:
+            raise InvalidTemplateError("Invalid regular expression %s" % self.regexsrc)
+        self.isparsed = True
+
+    def match(self, request_path, method):
+        if not self.isparsed:
+            self.compile()
+        if method in self.appdict or "_ANY_" in self.appdict:
+            match = self.regex.match(request_path)
+            if match:
+                return (self.appdict.get(method, self.appdict.get('_ANY_', None)), match.end(), match.groups(), match.groupdict())
+        return None
+
+    def dispatch(self, environ, start_response, match):
+        app, end, groups, groupdict = match
         script_name = environ.get('SCRIPT_NAME', '')
         request_path = environ.get('PATH_INFO', '')
-        method = environ.get('REQUEST_METHOD', 'GET')
-        match = self.regex.match(request_path)
-        if match:
-            extra_request_path = request_path[match.end():]
-            pos, named = environ.get('wsgiorg.routing_args', ((), {}))
-            new_named = named.copy()
-            new_named.update(match.groupdict())
-            new_pos = list(pos) + list(match.groups())
-            environ['wsgiorg.routing_args'] = (new_pos, new_named)
-            environ['SCRIPT_NAME'] = script_name + request_path[:match.end()]
-            environ['PATH_INFO'] = extra_request_path
-            environ['wsgiorg.routing_args']= (list(match.groups()), match.groupdict())
-            if method in self.appdict or "_ANY_" in self.appdict:
-                return self.appdict.get(method, self.appdict.get('_ANY_', None))(environ, start_response)
-        return NOMATCH
+        environ['SCRIPT_NAME'] = script_name + request_path[:end]
+        environ['PATH_INFO'] = request_path[end:]
+        environ['wsgiorg.routing_args']= (list(groups), groupdict.copy())
+        return app(environ, start_response)
+
+    def __call__(self, environ, start_response):
+        match = self.match(environ.get('PATH_INFO', ''), environ.get('REQUEST_METHOD', 'GET'))
+        if match == None:
+            return NOMATCH
+        return self.dispatch(environ, start_response, match)
+
+
+class MountPredicate(object):
+    """Matches a plain path prefix and every path below it,
+    and hands the request on to another WSGI application,
+    usually another Dispatcher, with the prefix moved from
+    PATH_INFO onto the end of SCRIPT_NAME."""
+    def __init__(self, path, app):
+        self.path = path.rstrip("/")
+        self.app = app
+        self.prefix = self.path + "/"
+        self.route = self.path
+        self.isparsed = True
+
+    def compile(self):
+        pass
+
+    def match(self, request_path, method):
+        if request_path == self.path or request_path.startswith(self.prefix):
+            return (self.app, len(self.path), (), {})
+        return None
+
+    def dispatch(self, environ, start_response, match):
+        app, end, groups, groupdict = match
+        script_name = environ.get('SCRIPT_NAME', '')
+        request_path = environ.get('PATH_INFO', '')
+        environ['SCRIPT_NAME'] = script_name + request_path[:end]
+        environ['PATH_INFO'] = request_path[end:]
+        return app(environ, start_response)
+
+    def __call__(self, environ, start_response):
+        match = self.match(environ.get('PATH_INFO', ''), environ.get('REQUEST_METHOD', 'GET'))
+        if match == None:
+            return NOMATCH
+        return self.dispatch(environ, start_response, match)
 
 
 class Dispatcher(object):
 
-    def __init__(self, handle404 = None, ranges = None):
+    def __init__(self, handle404 = None, ranges = None, precompile = False, cache_size = 0, metrics = None):
         """
 handle404 - A WSGI application to be used when no match is found for a requested URI path.
 
 ranges - A dictionary that maps new range names to regular expressions that match those characters. 
 
+precompile - If True then templates and regular expressions are compiled
+   when they are added, instead of on the first request that tries them,
+   so that invalid ones raise InvalidTemplateError from add() or addregex().
+
+cache_size - If greater than zero then the matches for the most recently
+   requested (REQUEST_METHOD, PATH_INFO) pairs are kept in an LRU cache 
+   of that size, available as ``Dispatcher.cache``, and a request for 
+   one of them goes straight to its application. The cache is emptied
+   whenever a route is added.
+
+metrics - A robaccia.metrics.Metrics instance to record the route, method, 
+   status and latency of every request in. Only the outermost Dispatcher
+   that a request passes through records it, under the routes of every 
+   Dispatcher it passed through joined together.
+
 Example::
     import logging 
 
@@ -412,6 +593,15 @@ Example::
 
         """
         self.matchers = []
+        self.index = RouteIndex()
+        # Plain string paths, keyed on (path, method), map to (position, predicate).
+        self.literals = {}
+        self.precompile = precompile
+        self.frozen = False
+        self.cache = None
+        if cache_size > 0:
+            self.cache = LRUCache(cache_size)
+        self.metrics = metrics
         if handle404 == None:
             self.handle404 = self._404 
         else:
@@ -431,12 +621,73 @@ Example::
         a WSGI application. See the module level documentation
         for an example."""
         logger.info(environ.get('PATH_INFO', '-no path given-'))
-        for predicate in self.matchers:
-            ret = predicate(environ, start_response)
-            if ret != NOMATCH:
-                return ret
+        if self.metrics != None and TIMINGS_KEY not in environ:
+            return self._measure(environ, start_response)
+        return self._dispatch(environ, start_response, self._find(environ))
+
+    def _find(self, environ):
+        request_path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if self.cache != None:
+            found = self.cache.get((method, request_path), None)
+            if found == None:
+                found = self.match(request_path, method)
+                if found != None:
+                    self.cache.put((method, request_path), found)
+        else:
+            found = self.match(request_path, method)
+        return found
+
+    def _dispatch(self, environ, start_response, found):
+        if found != None:
+            predicate, match = found
+            environ['robaccia.route'] = environ.get('robaccia.route', '') + predicate.route
+            return predicate.dispatch(environ, start_response, match)
         return self.handle404(environ, start_response)
 
+    def _measure(self, environ, start_response):
+        start = time.time()
+        timings = environ[TIMINGS_KEY] = {}
+        method = environ.get('REQUEST_METHOD', 'GET')
+        found = self._find(environ)
+        routed = time.time()
+        status = ['500']
+        def measured_start_response(response_status, response_headers, exc_info=None):
+            status[0] = response_status.split(' ', 1)[0]
+            if exc_info:
+                return start_response(response_status, response_headers, exc_info)
+            return start_response(response_status, response_headers)
+        def record():
+            handled = time.time() - routed - timings.get('db', 0.0) - timings.get('render', 0.0)
+            timings['routing'] = routed - start
+            timings['handler'] = max(handled, 0.0)
+            self.metrics.record(environ.get('robaccia.route', '-'), method, status[0], timings)
+        try:
+            result = self._dispatch(environ, measured_start_response, found)
+        except:
+            record()
+            raise
+        return _Measured(result, record)
+
+    def match(self, request_path, method):
+        """Returns the first predicate that matches the request path
+        and method, along with the result of its match(), as a tuple 
+        (predicate, match), or None if nothing matches."""
+        literal = self.literals.get((request_path, method), None)
+        any = self.literals.get((request_path, '_ANY_'), None)
+        if any and (not literal or any[0] < literal[0]):
+            literal = any
+        for position, predicate in self.index.candidates(request_path):
+            if literal and position > literal[0]:
+                break
+            match = predicate.match(request_path, method)
+            if match != None:
+                return (predicate, match)
+        if literal:
+            predicate = literal[1]
+            return (predicate, predicate.match(request_path, method))
+        return None
+
     def _appmap(self, args, kwargs):
         appmap = {}
         if args and kwargs: 
@@ -449,6 +700,43 @@ Example::
             appmap.update(kwargs)
         return appmap
 
+    def freeze(self):
+        """Compiles every template and regular expression added so far
+        and stops any more from being added. Invalid templates raise 
+        InvalidTemplateError here, at startup, instead of on the first
+        request that tries them. Once frozen the route table is never
+        modified again, so it can be shared between threads without locking.
+
+        Example::
+            urls = Dispatcher()
+            urls.add('/index/{name}', GET=hello)
+            urls.freeze()
+        """
+        for predicate in self.matchers:
+            if not predicate.isparsed:
+                predicate.compile()
+            if isinstance(predicate, MountPredicate) and isinstance(predicate.app, Dispatcher):
+                predicate.app.freeze()
+        self.frozen = True
+
+    def _addpredicate(self, predicate):
+        if self.frozen:
+            raise DispatcherException("Can not add routes to a frozen Dispatcher.")
+        if self.precompile:
+            predicate.compile()
+        position = len(self.matchers)
+        if isinstance(predicate, TemplatePredicate) and not predicate.istemplate:
+            for method in predicate.appdict:
+                self.literals.setdefault((predicate.path, method), (position, predicate))
+        elif isinstance(predicate, MountPredicate):
+            self.literals.setdefault((predicate.path, '_ANY_'), (position, predicate))
+            self.index.add(predicate.prefix, position, predicate)
+        else:
+            self.index.add(predicate.prefix, position, predicate)
+        self.matchers.append(predicate)
+        if self.cache != None:
+            self.cache.clear()
+
     def add(self, path, *args, **kwargs):
         """You can either add a WSGI application to handle all the matches,
         or you can add applications based on the method. 
@@ -464,7 +752,7 @@ Example::
         will result in a 404, while a POST will call ``app3``.
         """
         appmap = self._appmap(args, kwargs)
-        self.matchers.append(TemplatePredicate(path, appmap, self.ranges))
+        self._addpredicate(TemplatePredicate(path, appmap, self.ranges))
 
     def addregex(self, regex, *args, **kwargs):
         """Same exact operation as add, except that 'regex' is a regular
@@ -482,5 +770,45 @@ Example::
 
         """
         appmap = self._appmap(args, kwargs)
-        self.matchers.append(RegexPredicate(regex, appmap, self.ranges))
+        self._addpredicate(RegexPredicate(regex, appmap, self.ranges))
+
+    def mount(self, prefix, app):
+        """Hands every request for the plain path ``prefix``, or any 
+        path below it, to ``app``, which is usually another Dispatcher.
+        The prefix is moved from the end of PATH_INFO onto SCRIPT_NAME,
+        so the routes of the mounted Dispatcher are relative to the
+        prefix. Only the routes of the mounted Dispatcher are
+        searched for the requests it receives.
+
+        Example::
+            admin = Dispatcher()
+            admin.add("/users/{id}", GET=user)
+
+            d = Dispatcher()
+            d.mount("/admin", admin)
 
+        A GET of ``/admin/users/joe`` will call ``user`` with a 
+        SCRIPT_NAME of ``/admin`` and a PATH_INFO of ``/users/joe``.
+        """
+        if prefix.find("{") > -1 or prefix.find("[") > -1 or prefix.find("|") > -1:
+            raise InvalidArgumentError("The prefix of a mount must be a plain path: %s" % prefix)
+        self._addpredicate(MountPredicate(prefix, app))
+
+
+class _Measured(object):
+    """Wraps a response iterable so that a request is recorded
+    when the server closes it, after the body has been sent and
+    start_response has been called, however lazily."""
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close()
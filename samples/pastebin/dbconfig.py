@@ -1,4 +1,9 @@
 from sqlalchemy import *
+from robaccia.database import configure
 
-metadata = BoundMetaData('sqlite:///database.db')
+# Each thread keeps its own connection and at most pool_size threads
+# use the database at once. WAL lets readers carry on while a write
+# is in progress.
+metadata = configure('sqlite:///database.db', pool_size=5,
+        journal_mode='WAL', synchronous='NORMAL', cache_size=-8000)
 
@@ -1,4 +1,5 @@
 from robaccia.defaultmodelcollection import DefaultModelCollection
+from robaccia.rowcache import RowCache
 from robaccia import render, form_parser
 from models.bin import table
 
@@ -20,6 +21,7 @@ class Collection(DefaultModelCollection):
     def create(self, environ, start_response):
         pass
 
-app = Collection('html', render, form_parser, table)
+app = Collection('html', render, form_parser, table, page_size=50,
+        list_fields=['language', 'filename'], row_cache=RowCache())
 
 
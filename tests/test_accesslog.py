@@ -0,0 +1,86 @@
+import unittest
+import logging
+import Queue
+import os
+import simplejson
+from robaccia.accesslog import AccessLog, QueueHandler, BackgroundWriter, BatchFileHandler, JSONFormatter, SamplingFilter
+from tests.utils import cleanup, TEST_DIR
+
+class Capture(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        cleanup()
+
+    def _start_response(self, status, headers):
+        pass
+
+    def _app(self, environ, start_response):
+        environ['robaccia.route'] = '/{view}/'
+        start_response("201 Created", [])
+        return ["Hello", " World"]
+
+    def test_access_log(self):
+        capture = Capture()
+        logger = logging.getLogger('tests.access')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(capture)
+        app = AccessLog(self._app, 'tests.access')
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/fred/', 'HTTP_X_REQUEST_ID': 'abc'}
+        result = app(environ, self._start_response)
+        self.assertEqual("Hello World", "".join(result))
+        self.assertEqual([], capture.records)
+        result.close()
+        access = capture.records[0].access
+        self.assertEqual('POST', access['method'])
+        self.assertEqual('/fred/', access['path'])
+        self.assertEqual('/{view}/', access['route'])
+        self.assertEqual('201', access['status'])
+        self.assertEqual(11, access['bytes'])
+        self.assertEqual('abc', access['request_id'])
+        record = simplejson.loads(JSONFormatter().format(capture.records[0]))
+        self.assertEqual('abc', record['request_id'])
+
+    def test_request_ids(self):
+        import threading
+        app = AccessLog(self._app, 'tests.access')
+        ids = []
+        def make():
+            ids.extend([app._request_id() for i in range(1000)])
+        threads = [threading.Thread(target=make) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(4000, len(set(ids)))
+
+    def test_background_writer(self):
+        queue = Queue.Queue(100)
+        writer = BackgroundWriter(queue)
+        filename = os.path.join(TEST_DIR, "detail.log")
+        handler = BatchFileHandler(filename, "a", 100000, 5)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        queued = QueueHandler(queue, handler)
+        queued.addFilter(SamplingFilter(0.0))
+        logger = logging.getLogger('tests.background')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(queued)
+        writer.start()
+        logger.debug("sampled out")
+        logger.info("one %s", "two")
+        writer.stop()
+        handler.close()
+        f = file(filename, "r")
+        self.assertEqual("INFO one two\n", f.read())
+        f.close()
+
@@ -0,0 +1,74 @@
+import unittest
+from robaccia.cache import LRUCache, RenderCache
+import time
+
+class Test(unittest.TestCase):
+
+    def test_eviction(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual(1, c.get('a'))
+        c.put('c', 3)
+        self.assertEqual(None, c.get('b'))
+        self.assertEqual(1, c.get('a'))
+        self.assertEqual(3, c.get('c'))
+        self.assertEqual({'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1}, c.stats())
+
+    def test_replace(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('a', 2)
+        self.assertEqual(1, len(c))
+        self.assertEqual(2, c.get('a'))
+        self.assertEqual(0, c.evictions)
+
+    def test_delete_and_clear(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        c.delete('a')
+        self.assertFalse('a' in c)
+        self.assertEqual('missing', c.get('a', 'missing'))
+        c.clear()
+        self.assertEqual(0, len(c))
+        c.put('c', 3)
+        self.assertEqual(3, c.get('c'))
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def test_max_bytes(self):
+        c = RenderCache(size=10, max_bytes=10)
+        self.assertTrue(c.put('a', ("200 Ok", [], "aaaa")))
+        self.assertTrue(c.put('b', ("200 Ok", [], "bbbb")))
+        self.assertTrue(c.put('c', ("200 Ok", [], "cccc")))
+        self.assertEqual(None, c.get('a'))
+        self.assertEqual(("200 Ok", [], "cccc"), c.get('c'))
+        self.assertEqual(8, c.bytes)
+        self.assertEqual(1, c.evictions)
+        self.assertFalse(c.put('d', ("200 Ok", [], "d" * 11)))
+        self.assertEqual(2, len(c))
+
+    def test_ttl(self):
+        c = RenderCache(ttl=60)
+        c.put('a', ("200 Ok", [], "aaaa"))
+        self.assertEqual("aaaa", c.get('a')[2])
+        c._map['a'][3] = (time.time() - 1,) + c._map['a'][3][1:]
+        self.assertEqual(None, c.get('a'))
+        self.assertEqual(1, c.expirations)
+        self.assertEqual(0, c.bytes)
+
+    def test_invalidate(self):
+        c = RenderCache()
+        generation = c.generation('fred')
+        c.put('a', ("200 Ok", [], "aaaa"), 'fred', generation)
+        c.put('b', ("200 Ok", [], "bbbb"), 'barney', c.generation('barney'))
+        c.invalidate('fred')
+        self.assertEqual(None, c.get('a'))
+        self.assertEqual("bbbb", c.get('b')[2])
+        self.assertFalse(c.put('a', ("200 Ok", [], "aaaa"), 'fred', generation))
+        self.assertTrue(c.put('a', ("200 Ok", [], "aaaa"), 'fred', c.generation('fred')))
+        stats = c.stats()
+        self.assertEqual(1, stats['invalidations'])
+        self.assertEqual(8, stats['bytes'])
@@ -1,4 +1,6 @@
 import re
+import time
+import threading
 from robaccia.wsgidispatcher import Dispatcher
 from robaccia.wsgicollection import Collection
 import unittest
@@ -151,6 +153,7 @@ class TestDispatcherMisses(unittest.TestCase):
 
     def start_response(self, status, headers):
         self.status = int(status.split(' ')[0])
+        self.headers = dict(headers)
 
 
     def test_missing(self):
@@ -159,7 +162,21 @@ class TestDispatcherMisses(unittest.TestCase):
             "REQUEST_METHOD": "POST"
         }
         self.select(environ, self.start_response)
-        self.assertEqual(404, self.status)
+        self.assertEqual(405, self.status)
+        self.assertEqual('GET', self.headers['Allow'])
+
+    def test_missing_entry(self):
+        environ = {
+            "PATH_INFO": "/blog/1",
+            "REQUEST_METHOD": "PUT"
+        }
+        self.select(environ, self.start_response)
+        self.assertEqual(405, self.status)
+        self.assertEqual('DELETE', self.headers['Allow'])
+
+    def test_handler_table(self):
+        self.assertEqual('delete', self.MyIncompleteColl._handlers[('DELETE', None, True)])
+        self.assertFalse(('GET', '_ok', False) in self.MyIncompleteColl._handlers)
 
     def test_list(self):
         environ = {
@@ -214,6 +231,15 @@ class TestUrlVars(unittest.TestCase):
             "wsgiorg.routing_args": ((), {})
         }
         self.collection(environ, self.start_response)
+        self.assertEqual(405, self.status)
+
+    def test_miss_noun(self):
+        environ = {
+            "PATH_INFO": "/blog/;old_form",
+            "REQUEST_METHOD": "GET",
+            "wsgiorg.routing_args": ((), {'noun': 'old_form'})
+        }
+        self.collection(environ, self.start_response)
         self.assertEqual(404, self.status)
 
     def test_list(self):
@@ -255,3 +281,51 @@ class TestUrlVars(unittest.TestCase):
         self.assertEqual(500, self.status)
 
 
+class TestConcurrency(unittest.TestCase):
+    class MyColl(Collection):
+        def retrieve(self, environ, start_response):
+            time.sleep(0.0001)
+            start_response("200 Ok", [("Content-Type", "text/plain")])
+            return [self._id, self._function_name, environ.get('wsgicollection.request', self).id]
+
+        def get_edit_form(self, environ, start_response):
+            # Reentrant call on the same instance.
+            inner = self({'REQUEST_METHOD': 'GET', 'wsgiorg.routing_args': ((), {'id': 'inner'})}, start_response)
+            return [self._id, self._noun] + inner
+
+    def start_response(self, status, headers):
+        pass
+
+    def test_threads(self):
+        collection = self.MyColl()
+        errors = []
+        def worker(n):
+            for i in range(50):
+                id = "%d-%d" % (n, i)
+                environ = {
+                    "REQUEST_METHOD": "GET",
+                    "wsgiorg.routing_args": ((), {'id': id})
+                }
+                try:
+                    result = collection(environ, self.start_response)
+                except Exception, e:
+                    result = e
+                if result != [id, 'retrieve', id]:
+                    errors.append((id, result))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+
+    def test_reentrant(self):
+        collection = self.MyColl()
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "wsgiorg.routing_args": ((), {'id': 'outer', 'noun': 'edit_form'})
+        }
+        self.assertEqual(['outer', 'edit_form', 'inner', 'retrieve', 'inner'], collection(environ, self.start_response))
+        self.assertEqual('outer', environ['wsgicollection.request'].id)
+        self.assertEqual('', collection._id)
+
@@ -0,0 +1,130 @@
+import unittest
+import zlib
+import gzip
+import StringIO
+from robaccia.compress import Compress, choose_encoding, compressible
+
+BODY = "<p>Hello World!</p>" * 100
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.closed = 0
+
+    def _start_response(self, status, headers):
+        self.status = status
+        self.headers = dict([(key.lower(), value) for (key, value) in headers])
+
+    def _app(self, content_type="text/html", body=BODY, etag='"abc"'):
+        def app(environ, start_response):
+            self.calls += 1
+            self.if_none_match = environ.get('HTTP_IF_NONE_MATCH', None)
+            headers = [('Content-Type', content_type)]
+            if etag:
+                headers.append(('ETag', etag))
+            start_response("200 Ok", headers)
+            return _Closing(self, [body[:100], body[100:]])
+        return app
+
+    def _get(self, app, accept_encoding="gzip, deflate", **kwargs):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/fred/', 'HTTP_ACCEPT_ENCODING': accept_encoding}
+        environ.update(kwargs)
+        result = app(environ, self._start_response)
+        try:
+            return "".join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def test_choose_encoding(self):
+        self.assertEqual('gzip', choose_encoding("gzip, deflate"))
+        self.assertEqual('deflate', choose_encoding("gzip;q=0.5, deflate"))
+        self.assertEqual('gzip', choose_encoding("x-gzip"))
+        self.assertEqual('deflate', choose_encoding("*, gzip;q=0"))
+        self.assertEqual(None, choose_encoding("identity"))
+        self.assertEqual(None, choose_encoding(""))
+        self.assertTrue(compressible("application/json; charset=utf-8"))
+        self.assertTrue(compressible("application/atom+xml"))
+        self.assertFalse(compressible("image/png"))
+
+    def test_gzip(self):
+        body = self._get(Compress(self._app()))
+        self.assertEqual('gzip', self.headers['content-encoding'])
+        self.assertEqual('Accept-Encoding', self.headers['vary'])
+        self.assertEqual('"abc-gzip"', self.headers['etag'])
+        self.assertEqual(BODY, gzip.GzipFile(fileobj=StringIO.StringIO(body)).read())
+        self.assertTrue(len(body) < len(BODY))
+        self.assertEqual(1, self.closed)
+
+    def test_deflate(self):
+        body = self._get(Compress(self._app()), "deflate")
+        self.assertEqual('deflate', self.headers['content-encoding'])
+        self.assertEqual(BODY, zlib.decompress(body))
+
+    def test_not_compressed(self):
+        app = Compress(self._app())
+        self.assertEqual(BODY, self._get(app, "identity"))
+        self.assertFalse('content-encoding' in self.headers)
+        self.assertEqual('Accept-Encoding', self.headers['vary'])
+        self.assertEqual('"abc"', self.headers['etag'])
+
+        self.assertEqual(BODY, self._get(Compress(self._app(content_type="image/png"))))
+        self.assertFalse('content-encoding' in self.headers)
+        self.assertFalse('vary' in self.headers)
+
+        self.assertEqual("<p>Hi</p>", self._get(Compress(self._app(body="<p>Hi</p>"))))
+        self.assertFalse('content-encoding' in self.headers)
+        self.assertEqual('Accept-Encoding', self.headers['vary'])
+        self.assertEqual(3, self.closed)
+
+    def test_cache(self):
+        app = Compress(self._app())
+        first = self._get(app)
+        self.assertEqual(first, self._get(app))
+        self.assertEqual('"abc-gzip"', self.headers['etag'])
+        self.assertEqual(1, app.cache.hits)
+        self.assertEqual(2, self.closed)
+        self._get(app, "gzip", HTTP_IF_NONE_MATCH='"abc-gzip"')
+        self.assertEqual('"abc"', self.if_none_match)
+        self._get(app, "gzip", PATH_INFO='/barney/')
+        self.assertEqual(2, app.cache.hits)
+
+        app = Compress(self._app(etag=None))
+        self._get(app)
+        self.assertEqual(0, len(app.cache))
+
+    def test_generator(self):
+        def app(environ, start_response):
+            start_response("200 Ok", [('Content-Type', 'text/plain')])
+            yield BODY
+        body = self._get(Compress(app), "deflate")
+        self.assertEqual(BODY, zlib.decompress(body))
+
+    def test_many_chunks(self):
+        chunks = ["<p>Row %d</p>" % i for i in range(2000)]
+        def app(environ, start_response):
+            start_response("200 Ok", [('Content-Type', 'text/html')])
+            return chunks
+        body = self._get(Compress(app), "deflate")
+        self.assertEqual("".join(chunks), zlib.decompress(body))
+        self.assertTrue(len(body) < len(zlib.compress("".join(chunks), 6)) * 1.1)
+
+    def test_empty_without_start_response(self):
+        def app(environ, start_response):
+            return []
+        self.status = None
+        self.assertEqual("", self._get(Compress(app)))
+        self.assertEqual(None, self.status)
+
+
+class _Closing(object):
+    def __init__(self, test, chunks):
+        self.test = test
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.test.closed += 1
@@ -0,0 +1,87 @@
+import unittest
+import os
+import threading
+import time
+from sqlalchemy import Table, Column, Integer, String, exceptions
+from robaccia.database import configure, pool_stats, pools, sqlite_creator, ThreadAffinePool
+
+FILENAME = os.path.join("tests", "output", "pooled.db")
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._remove()
+
+    def tearDown(self):
+        self._remove()
+
+    def _remove(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(FILENAME + suffix):
+                os.remove(FILENAME + suffix)
+
+    def test_pragmas(self):
+        connection = sqlite_creator(FILENAME, cache_size=-4000, mmap_size=1024*1024)()
+        self.assertEqual('wal', connection.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual(1, connection.execute("PRAGMA synchronous").fetchone()[0])
+        self.assertEqual(-4000, connection.execute("PRAGMA cache_size").fetchone()[0])
+        connection.close()
+
+    def test_configure(self):
+        url = 'sqlite:///' + FILENAME
+        metadata = configure(url, pool_size=2)
+        table = Table('fred', metadata,
+                Column('id', Integer(), primary_key=True),
+                Column('description', String(250)))
+        table.create()
+        table.insert().execute(description="First Post!")
+        self.assertEqual(u"First Post!", table.select().execute().fetchone()['description'])
+        stats = pool_stats()[url]
+        self.assertEqual(0, stats['in_use'])
+        self.assertTrue(stats['checkouts'] >= 3)
+
+        seen = []
+        def reader():
+            seen.append(table.select().execute().fetchone()['description'])
+        threads = [threading.Thread(target=reader) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([u"First Post!"] * 4, seen)
+        self.assertTrue(pools[url].max_in_use <= 2)
+        pools[url].dispose()
+
+    def test_wait_and_timeout(self):
+        pool = ThreadAffinePool(sqlite_creator(FILENAME), pool_size=1, timeout=0.2)
+        held = pool.connect()
+        self.assertEqual(1, pool.in_use)
+        self.assertTrue(held is pool.connect())
+        errors = []
+        def other():
+            try:
+                pool.connect()
+            except exceptions.TimeoutError, e:
+                errors.append(e)
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+        self.assertEqual(1, len(errors))
+        self.assertEqual(1, pool.timeouts)
+
+        got = []
+        def waiter():
+            connection = pool.connect()
+            got.append(connection)
+            connection.close()
+        t = threading.Thread(target=waiter)
+        t.start()
+        time.sleep(0.05)
+        held.close()
+        held.close()
+        t.join()
+        self.assertEqual(1, len(got))
+        self.assertEqual(2, pool.waits)
+        self.assertTrue(pool.wait_time > 0)
+        self.assertEqual(0, pool.in_use)
+        self.assertEqual(1, pool.max_in_use)
@@ -1,5 +1,6 @@
 from robaccia.defaultcollection import DefaultCollection
 import unittest
+import threading
 
 class MyColl(DefaultCollection):
 
@@ -77,9 +78,65 @@ class Test(unittest.TestCase):
         self.assertEqual(None, self.environ)
         self.assertEqual(None, self.vars)
 
-
-
-
-
-
+    def test_negotiate(self):
+        headers = {}
+        def renderer(environ, start_response, template_file, vars, response_headers={}, status="200 Ok", raw_etag=None):
+            self._renderer(environ, start_response, template_file, vars, response_headers)
+            headers.update(response_headers)
+            return []
+        app = MyColl('html', renderer, negotiate=True)
+        for (accept, template_file) in [
+                (None, 'fred/list.html'),
+                ('application/json', 'fred/list.json'),
+                ('application/json;q=0.5, text/html', 'fred/list.html'),
+                ('*/*', 'fred/list.html'),
+                ('image/png', 'fred/list.html')]:
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "wsgiorg.routing_args": ((), {
+                    'view': 'fred'
+                    })
+            }
+            if accept:
+                environ['HTTP_ACCEPT'] = accept
+            app(environ, self.start_response)
+            self.assertEqual(template_file, self.template_file)
+            self.assertEqual('Accept', headers['vary'])
+
+        app = MyColl('json', self._renderer, negotiate=True)
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "HTTP_ACCEPT": "*/*",
+            "wsgiorg.routing_args": ((), {
+                'view': 'fred'
+                })
+        }
+        app(environ, self.start_response)
+        self.assertEqual('fred/list.json', self.template_file)
+
+    def test_threads(self):
+        rendered = []
+        def renderer(environ, start_response, template_file, vars, headers={}, status="200 Ok", raw_etag=None):
+            rendered.append((environ['wsgiorg.routing_args'][1]['id'], template_file, vars['id']))
+            return []
+        app = MyColl('html', renderer)
+        def worker(n):
+            for i in range(50):
+                environ = {
+                    "REQUEST_METHOD": "GET",
+                    "wsgiorg.routing_args": ((), {
+                        'id': "%d-%d" % (n, i),
+                        'view': 'fred'
+                        })
+                }
+                app(environ, self.start_response)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1000, len(rendered))
+        for id, template_file, vars_id in rendered:
+            self.assertEqual(id, vars_id)
+            self.assertEqual('fred/retrieve.html', template_file)
 
@@ -3,6 +3,8 @@ import robaccia
 import unittest
 import urllib
 import StringIO
+from robaccia.cache import RenderCache
+from robaccia.rowcache import RowCache
 
 class MyColl(DefaultModelCollection):
 
@@ -85,7 +87,7 @@ class Test(unittest.TestCase):
         self.assertEqual(200, self.status)
         self.assertEqual('fred/retrieve.html', self.template_file)
         self.assertEqual(environ, self.environ)
-        self.assertEqual(self.vars, {'primary': 'id', "row": {'id': 1, 'description': u'First Post!'}})
+        self.assertEqual(self.vars, {'primary': 'id', "row": {'id': 1, 'description': u'First Post!'}, 'meta': ['id', 'description']})
 
         body = urllib.urlencode({
                         "description": "Second Post!"
@@ -156,7 +158,267 @@ class Test(unittest.TestCase):
         self.assertEqual(200, self.status)
         self.assertEqual('fred/retrieve.html', self.template_file)
         self.assertEqual(environ, self.environ)
-        self.assertEqual(self.vars, {'primary': 'id', "row": {'id': 2, 'description': u'Second Post!'}})
+        self.assertEqual(self.vars, {'primary': 'id', "row": {'id': 2, 'description': u'Second Post!'}, 'meta': ['id', 'description']})
+
+    def test_stream(self):
+        model.insert().execute(description="First Post!")
+        model.insert().execute(description="Second Post!")
+        model.insert().execute(description="Third Post!")
+        app = MyColl('html', self._renderer, robaccia.form_parser, model, stream=True, fetch_size=2)
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "wsgiorg.routing_args": ((), {
+                'view': 'fred'
+                }),
+        }
+        app(environ, self.start_response)
+        self.assertEqual(200, self.status)
+        self.assertEqual(True, environ[robaccia.STREAM_KEY])
+        self.assertFalse(isinstance(self.vars['data'], list))
+        self.assertEqual([u'First Post!', u'Second Post!', u'Third Post!'], [row['description'] for row in self.vars['data']])
+
+
+    def test_render_cache(self):
+        model.insert().execute(description="First Post!")
+        cache = RenderCache()
+        app = MyColl('json', robaccia.render, robaccia.json_parser, model, render_cache=cache)
+        def get():
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "wsgiorg.routing_args": ((), {
+                    'id': '1',
+                    'view': 'fred'
+                    }),
+            }
+            return "".join(app(environ, self.start_response))
+        self.assertEqual(get(), get())
+        self.assertEqual(200, self.status)
+        self.assertEqual(1, cache.hits)
+        self.assertTrue("First Post!" in get())
+
+        body = '{"description": "Edited"}'
+        environ = {
+            "REQUEST_METHOD": "PUT",
+            "wsgiorg.routing_args": ((), {
+                'id': '1',
+                'view': 'fred'
+                }),
+            "wsgi.input": StringIO.StringIO(body),
+            "CONTENT_LENGTH": len(body),
+        }
+        app(environ, self.start_response)
+        self.assertEqual(303, self.status)
+        self.assertEqual(1, cache.invalidations)
+        self.assertTrue("Edited" in get())
+
+
+    def test_conditional_get(self):
+        model.insert().execute(description="First Post!")
+        headers = {}
+        def start_response(status, response_headers):
+            self.start_response(status, response_headers)
+            headers.clear()
+            headers.update(dict(response_headers))
+        def get(app, id=None, **kwargs):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "wsgiorg.routing_args": ((), {
+                    'view': 'fred'
+                    }),
+            }
+            if id:
+                environ["wsgiorg.routing_args"][1]['id'] = id
+            environ.update(kwargs)
+            return "".join(app(environ, start_response))
+
+        app = MyColl('json', robaccia.render, robaccia.json_parser, model)
+        self.assertTrue("First Post!" in get(app, '1'))
+        etag = headers['etag']
+        self.assertEqual("", get(app, '1', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(304, self.status)
+        get(app, '1', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(200, self.status)
+        get(app)
+        self.assertFalse('etag' in headers)
+
+        app = MyColl('json', robaccia.render, robaccia.json_parser, model, table_validators=True)
+        get(app)
+        etag = headers['etag']
+        last_modified = headers['last-modified']
+        self.assertEqual("", get(app, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(304, self.status)
+        self.assertEqual("", get(app, HTTP_IF_MODIFIED_SINCE=last_modified))
+        self.assertEqual(304, self.status)
+
+        body = '{"description": "Second Post!"}'
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "wsgiorg.routing_args": ((), {
+                'view': 'fred'
+                }),
+            "wsgi.input": StringIO.StringIO(body),
+            "CONTENT_LENGTH": len(body),
+        }
+        app(environ, self.start_response)
+        self.assertTrue("Second Post!" in get(app, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(200, self.status)
+        self.assertNotEqual(etag, headers['etag'])
+
+
+    def test_pagination(self):
+        for i in range(7):
+            model.insert().execute(description="Post %d" % i)
+        app = MyColl('html', self._renderer, robaccia.form_parser, model, page_size=3, max_page_size=5)
+        def get(query=""):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "QUERY_STRING": query,
+                "wsgiorg.routing_args": ((), {
+                    'view': 'fred'
+                    }),
+            }
+            app(environ, self.start_response)
+            self.assertEqual(200, self.status)
+            return ([row['id'] for row in self.vars['data']], self.vars['page'])
+
+        self.assertEqual(([1, 2, 3], {'limit': 3, 'next': '?after=3&limit=3', 'prev': None}), get())
+        self.assertEqual(([4, 5, 6], {'limit': 3, 'next': '?after=6&limit=3', 'prev': '?before=4&limit=3'}), get('after=3&limit=3'))
+        self.assertEqual(([7], {'limit': 3, 'next': None, 'prev': '?before=7&limit=3'}), get('after=6&limit=3'))
+        self.assertEqual(([4, 5, 6], {'limit': 3, 'next': '?after=6&limit=3', 'prev': '?before=4&limit=3'}), get('before=7&limit=3'))
+        self.assertEqual(([1, 2, 3], {'limit': 3, 'next': '?after=3&limit=3', 'prev': None}), get('before=4&limit=3'))
+        self.assertEqual([1, 2, 3, 4, 5], get('limit=100')[0])
+        self.assertEqual([1], get('limit=-1')[0])
+        self.assertEqual([1, 2, 3], get('after=junk')[0])
+
+        app = MyColl('html', self._renderer, robaccia.form_parser, model)
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "wsgiorg.routing_args": ((), {
+                'view': 'fred'
+                }),
+        }
+        app(environ, self.start_response)
+        self.assertEqual(7, len(self.vars['data']))
+        self.assertFalse('page' in self.vars)
+
+
+    def test_fields(self):
+        for i in range(3):
+            model.insert().execute(description="Post %d" % i)
+        def get(app, query="", id=None):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "QUERY_STRING": query,
+                "wsgiorg.routing_args": ((), {
+                    'view': 'fred'
+                    }),
+            }
+            if id:
+                environ["wsgiorg.routing_args"][1]['id'] = id
+            app(environ, self.start_response)
+            self.assertEqual(200, self.status)
+            return self.vars
+
+        app = MyColl('html', self._renderer, robaccia.form_parser, model, list_fields=['id'])
+        vars = get(app)
+        self.assertEqual(['id'], vars['meta'])
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], list(vars['data']))
+        vars = get(app, 'fields=description,nonesuch')
+        self.assertEqual(['id', 'description'], vars['meta'])
+        self.assertEqual({'id': 1, 'description': u'Post 0'}, vars['data'][0])
+        vars = get(app, 'fields=id&limit=2')
+        self.assertEqual('?after=2&limit=2&fields=id', vars['page']['next'])
+        self.assertEqual([{'id': 1}, {'id': 2}], vars['data'])
+        self.assertEqual({'primary': 'id', 'row': {'id': 2}, 'meta': ['id']}, get(app, 'fields=id', '2'))
+        self.assertEqual({'primary': 'id', 'row': {'id': 2, 'description': u'Post 1'}, 'meta': ['id', 'description']}, get(app, '', '2'))
+
+        # The order the fields are asked for in doesn't make new Row classes or statements.
+        row = get(app, 'fields=description', '2')['row']
+        statements = len(app._statements)
+        for query in ['fields=description,id', 'fields=id,description', 'fields=description,id,description']:
+            vars = get(app, query, '2')
+            self.assertTrue(row.__class__ is vars['row'].__class__)
+            self.assertEqual(['id', 'description'], vars['meta'])
+        self.assertEqual(statements, len(app._statements))
+
+    def test_statements(self):
+        for i in range(3):
+            model.insert().execute(description="Post %d" % i)
+        app = MyColl('html', self._renderer, robaccia.form_parser, model)
+        def call(method, id, body=""):
+            environ = {
+                "REQUEST_METHOD": method,
+                "wsgiorg.routing_args": ((), {
+                    'id': id,
+                    'view': 'fred'
+                    }),
+                "wsgi.input": StringIO.StringIO(body),
+                "CONTENT_TYPE": "application/x-www-form-urlencoded",
+                "CONTENT_LENGTH": len(body),
+            }
+            app(environ, self.start_response)
+            return self.vars
+
+        self.assertEqual({'id': 1, 'description': u'Post 0'}, call("GET", "1")['row'])
+        statement = app._statement('id')
+        self.assertEqual({'id': 2, 'description': u'Post 1'}, call("GET", "2")['row'])
+        self.assertTrue(statement is app._statement('id'))
+        self.assertEqual(1, len(app._statements))
+
+        call("PUT", "2", urllib.urlencode({"description": "Edited"}))
+        call("PUT", "3", urllib.urlencode({"description": "Edited again"}))
+        call("DELETE", "1")
+        self.assertEqual(3, len(app._statements))
+        self.assertEqual([(2, u'Edited'), (3, u'Edited again')],
+                [tuple(row) for row in model.select(order_by=[model.c.id]).execute().fetchall()])
+
+
+    def test_row_cache(self):
+        model.insert().execute(description="First Post!")
+        cache = RowCache()
+        app = MyColl('html', self._renderer, robaccia.form_parser, model, row_cache=cache)
+        def call(method, id, body="", query=""):
+            environ = {
+                "REQUEST_METHOD": method,
+                "QUERY_STRING": query,
+                "wsgiorg.routing_args": ((), {
+                    'view': 'fred'
+                    }),
+                "wsgi.input": StringIO.StringIO(body),
+                "CONTENT_TYPE": "application/x-www-form-urlencoded",
+                "CONTENT_LENGTH": len(body),
+            }
+            if id:
+                environ["wsgiorg.routing_args"][1]['id'] = id
+            self.vars = None
+            app(environ, self.start_response)
+            return self.vars
+
+        self.assertEqual({'id': 1, 'description': u'First Post!'}, call("GET", "1")['row'])
+        # Rows are served from the cache, even if the table is changed behind its back.
+        model.update(model.c.id==1).execute(description="Changed")
+        self.assertEqual({'id': 1, 'description': u'First Post!'}, call("GET", "1")['row'])
+        self.assertEqual({'id': 1}, call("GET", "1", query="fields=id")['row'])
+        self.assertEqual(2, cache.hits)
+
+        call("PUT", "1", urllib.urlencode({"description": "Edited"}))
+        self.assertEqual({'id': 1, 'description': u'Edited'}, call("GET", "1")['row'])
+
+        call("GET", "2")
+        self.assertEqual(404, self.status)
+        call("GET", "2")
+        self.assertEqual(404, self.status)
+        self.assertEqual(1, cache.negative_hits)
+        call("POST", None, urllib.urlencode({"description": "Second Post!"}))
+        self.assertEqual(303, self.status)
+        self.assertEqual({'id': 2, 'description': u'Second Post!'}, call("GET", "2")['row'])
+
+        call("DELETE", "2")
+        call("GET", "2")
+        self.assertEqual(404, self.status)
+        call("GET", "nonesuch")
+        self.assertEqual(404, self.status)
+
 
 class TestFormEncoded(unittest.TestCase):
     class MyColl(DefaultModelCollection):
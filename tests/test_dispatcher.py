@@ -182,6 +182,137 @@ class Test(unittest.TestCase):
         self.assertEqual(self.environ['wsgiorg.routing_args'][1]['id'], 'fred')
 
 
+    def test_index_preserves_order(self):
+        urls = Dispatcher(self._my404)
+        urls.add('/{alpha}/[{id}]', GET=self._app1)
+        urls.add('/comments/[{id:alnum}]', _ANY_=self._app2)
+        urls.addregex('^/comments/(\d+)$', _ANY_=self._app3)
+
+        urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(1, self.app_number)
+        urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+        self.assertEqual(self.environ['wsgiorg.routing_args'][1]['id'], '2')
+
+    def test_index_regex_method_miss(self):
+        urls = Dispatcher(self._my404)
+        urls.addregex('^/comments/(\d+)$', PUT=self._app1)
+        urls.add('/comments/{id}', GET=self._app2)
+        urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+        self.assertEqual(self.environ['PATH_INFO'], '')
+        self.assertEqual(self.environ['SCRIPT_NAME'], '/comments/2')
+
+    def test_index_many_routes(self):
+        urls = Dispatcher(self._my404)
+        for i in range(100):
+            urls.add('/section%d/[{id}]' % i, _ANY_=self._app1)
+        urls.add('/section99/{id}', _ANY_=self._app2)
+        urls({'PATH_INFO': '/section99/fred', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(1, self.app_number)
+        self.assertEqual(self.environ['wsgiorg.routing_args'][1]['id'], 'fred')
+        self.assertEqual(1, len(urls.index.candidates('/section42/fred')))
+        urls({'PATH_INFO': '/section100/fred', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertTrue(self._404)
+
+    def test_literal_table(self):
+        urls = Dispatcher(self._my404)
+        urls.add('/health', GET=self._app1)
+        urls.add('/{alpha}', _ANY_=self._app2)
+        urls.add('/health', _ANY_=self._app3)
+        urls({'PATH_INFO': '/health', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(1, self.app_number)
+        self.assertEqual(self.environ['wsgiorg.routing_args'], ([], {}))
+        self.assertFalse(urls.matchers[1].isparsed)
+        urls({'PATH_INFO': '/health', 'REQUEST_METHOD': 'POST'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+
+    def test_literal_table_order(self):
+        urls = Dispatcher(self._my404)
+        urls.add('/fred/', GET=self._app1, _ANY_=self._app3)
+        urls.add('/fred/', GET=self._app2)
+        urls({'PATH_INFO': '/fred/', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(1, self.app_number)
+        urls({'PATH_INFO': '/fred/', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+        self.assertEqual(3, self.app_number)
+
+    def test_freeze(self):
+        urls = Dispatcher(self._my404)
+        urls.add('/{alpha}/[{id}]', GET=self._app1)
+        urls.addregex('^/comments/(\d+)$', _ANY_=self._app2)
+        urls.freeze()
+        self.assertTrue(urls.matchers[0].isparsed)
+        self.assertTrue(urls.matchers[1].isparsed)
+        try:
+            urls.add('/fred/', self._app)
+            self.fail("Frozen dispatchers can not be added to.")
+        except DispatcherException:
+            pass
+        urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+
+    def test_freeze_invalid(self):
+        urls = Dispatcher()
+        urls.add('/{alpha}/[{id}', GET=self._app1)
+        self.assertRaises(InvalidTemplateError, urls.freeze)
+        urls = Dispatcher()
+        urls.addregex('^/comments/(\d+$', GET=self._app1)
+        self.assertRaises(InvalidTemplateError, urls.freeze)
+
+    def test_precompile(self):
+        urls = Dispatcher(precompile=True)
+        self.assertRaises(InvalidTemplateError, urls.add, '/{alpha}/[{id}', GET=self._app1)
+        urls.addregex('^/comments/(\d+)$', _ANY_=self._app2)
+        self.assertTrue(urls.matchers[0].isparsed)
+
+    def test_cache(self):
+        urls = Dispatcher(self._my404, cache_size=2)
+        urls.add('/comments/[{id:alnum}]', GET=self._app1)
+        urls.addregex('^/([^/]+)/(?P<slug>\w+)$', _ANY_=self._app2)
+        for i in range(2):
+            urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '/blog'}, self._start_response)
+            self.assertEqual(1, self.app_number)
+            self.assertEqual(self.environ['wsgiorg.routing_args'][1]['id'], '2')
+            self.assertEqual(self.environ['SCRIPT_NAME'], '/blog/comments/2')
+            urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+            self.assertEqual(2, self.app_number)
+            self.assertEqual(self.environ['wsgiorg.routing_args'], (['comments', '2'], {'slug': '2'}))
+        self.assertEqual(2, urls.cache.hits)
+        self.assertEqual(2, urls.cache.misses)
+        urls.add('/comments/{id}', PUT=self._app3)
+        self.assertEqual(0, len(urls.cache))
+        urls({'PATH_INFO': '/comments/2', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+
+    def test_mount(self):
+        admin = Dispatcher(self._my404)
+        admin.add('/users/{id}', GET=self._app1)
+        admin.add('', GET=self._app2)
+        urls = Dispatcher(self._my404)
+        urls.add('/admin/{id}', PUT=self._app3)
+        urls.mount('/admin/', admin)
+
+        urls({'PATH_INFO': '/admin/users/joe', 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '/app'}, self._start_response)
+        self.assertEqual(1, self.app_number)
+        self.assertEqual(self.environ['SCRIPT_NAME'], '/app/admin/users/joe')
+        self.assertEqual(self.environ['wsgiorg.routing_args'][1]['id'], 'joe')
+
+        urls({'PATH_INFO': '/admin', 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '/app'}, self._start_response)
+        self.assertEqual(2, self.app_number)
+        self.assertEqual(self.environ['SCRIPT_NAME'], '/app/admin')
+
+        urls({'PATH_INFO': '/admin/joe', 'REQUEST_METHOD': 'PUT'}, self._start_response)
+        self.assertEqual(3, self.app_number)
+
+        self.app_number = 0
+        urls({'PATH_INFO': '/administrator', 'REQUEST_METHOD': 'GET'}, self._start_response)
+        self.assertEqual(0, self.app_number)
+        self.assertTrue(self._404)
+
+        self.assertRaises(InvalidArgumentError, urls.mount, '/{name}', admin)
+        urls.freeze()
+        self.assertTrue(admin.frozen)
+
 
 class Template2Regex(unittest.TestCase):
 
@@ -208,6 +339,21 @@ class Template2Regex(unittest.TestCase):
         for template, result in cases:
             self.assertEqual(template2regex(template), result)
 
-
-
+    def test_prefix(self):
+        cases = [
+                ("/service/[{ctype:alpha}]", "/service/"),
+                ("/{fred}", "/"),
+                ("/fred/|", "/fred/"),
+                ("/fred.html", "/fred"),
+                ]
+        for template, result in cases:
+            self.assertEqual(template_prefix(template), result)
+        cases = [
+                ("^/comments/(\d+)$", "/comments/"),
+                ("/blog/(?P<id>\w+)?", "/blog/"),
+                ("/blogs?/", "/blog"),
+                ("/a|/b", ""),
+                ]
+        for regex, result in cases:
+            self.assertEqual(regex_prefix(regex), result)
 
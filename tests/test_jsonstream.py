@@ -0,0 +1,36 @@
+import unittest
+from robaccia import jsonstream
+from robaccia.jsonstream import iterencode, dumps, loads
+
+class Test(unittest.TestCase):
+
+    def test_encoder(self):
+        self.assertTrue(jsonstream.ENCODER in ['simplejson', 'json'])
+        self.assertEqual('{"a": 1}', dumps({'a': 1}))
+        self.assertEqual({'a': [1, 2]}, loads('{"a": [1, 2]}'))
+
+    def test_iterencode(self):
+        rows = [{'id': 1, 'description': u'First Post!'}, {'id': 2, 'description': u'Caf\xe9'}]
+        vars = {'data': rows, 'primary': 'id', 'meta': ('id', 'description')}
+        self.assertEqual(dumps(vars), "".join(iterencode(vars)))
+        self.assertEqual(vars['data'], loads("".join(iterencode(vars)))['data'])
+
+    def test_iterencode_generator(self):
+        chunks = list(iterencode({'data': ({'id': i} for i in range(3)), 'empty': iter([])}))
+        self.assertTrue(', {"id": 1}' in chunks)
+        self.assertEqual({'data': [{'id': 0}, {'id': 1}, {'id': 2}], 'empty': []}, loads("".join(chunks)))
+        self.assertEqual('[[0, 1], "x", null]', "".join(iterencode([(i for i in range(2)), "x", None])))
+        self.assertEqual('{"1": true}', "".join(iterencode({1: True})))
+
+    def test_nested_rows(self):
+        import robaccia
+        from robaccia.rows import row_class
+        row = row_class(['id', 'a'])((1, u'x'))
+        expected = {'result': {'rows': [{'id': 1, 'a': u'x'}]}}
+        self.assertEqual([{'id': 1, 'a': u'x'}], loads(dumps([row])))
+        self.assertEqual(expected, loads(dumps({'result': {'rows': [row]}})))
+        self.assertEqual(expected, loads("".join(iterencode({'result': {'rows': [row]}}))))
+        self.assertEqual([[{'id': 1, 'a': u'x'}]], loads("".join(iterencode([(r for r in [row])]))))
+        self.assertEqual(expected, loads("".join(robaccia.render_json(lambda status, headers: None, {'result': {'rows': [row]}}))))
+        encoder = jsonstream._RowsEncoder(default=list)
+        self.assertEqual(expected, loads(encoder.encode({'result': {'rows': (row,)}})))
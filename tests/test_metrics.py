@@ -0,0 +1,86 @@
+import unittest
+from robaccia.wsgidispatcher import Dispatcher
+from robaccia.metrics import Metrics, Histogram, add_timing, TIMINGS_KEY
+
+class Test(unittest.TestCase):
+
+    def _start_response(self, status, headers):
+        pass
+
+    def _app(self, environ, start_response):
+        add_timing(environ, 'db', 0.002)
+        start_response("200 Ok", [])
+        return []
+
+    def _missing(self, environ, start_response):
+        start_response("404 Not Found", [])
+        return []
+
+    def _get(self, app, path, method='GET'):
+        result = app({'PATH_INFO': path, 'REQUEST_METHOD': method}, self._start_response)
+        try:
+            return "".join(result)
+        finally:
+            result.close()
+
+    def test_histogram(self):
+        h = Histogram()
+        h.observe(0.0005)
+        h.observe(0.003)
+        h.observe(20)
+        buckets = h.cumulative()
+        self.assertEqual((0.001, 1), buckets[0])
+        self.assertEqual((0.005, 2), buckets[2])
+        self.assertEqual(('+Inf', 3), buckets[-1])
+        self.assertEqual(3, h.count)
+
+    def test_add_timing(self):
+        environ = {}
+        add_timing(environ, 'db', 1.0)
+        self.assertFalse(TIMINGS_KEY in environ)
+        environ[TIMINGS_KEY] = {}
+        add_timing(environ, 'db', 1.0)
+        add_timing(environ, 'db', 0.5)
+        self.assertEqual({'db': 1.5}, environ[TIMINGS_KEY])
+
+    def test_dispatcher(self):
+        metrics = Metrics()
+        comments = Dispatcher(self._missing)
+        comments.add('/{id}', GET=self._app)
+        urls = Dispatcher(self._missing, metrics=metrics)
+        urls.add('/_metrics', GET=metrics.app)
+        urls.mount('/comments', comments)
+        for path in ['/comments/1', '/comments/2', '/comments/2/3', '/other']:
+            self._get(urls, path)
+        snapshot = metrics.snapshot()
+        route = snapshot[('/comments/{id}', 'GET')]
+        self.assertEqual(2, route['requests'])
+        self.assertEqual({'200': 2}, route['statuses'])
+        self.assertEqual(2, route['latency']['db']['count'])
+        self.assertEqual(2, route['latency']['routing']['count'])
+        self.assertEqual(0, route['latency']['render']['count'])
+        self.assertEqual({'404': 1}, snapshot[('/comments', 'GET')]['statuses'])
+        self.assertEqual({'404': 1}, snapshot[('-', 'GET')]['statuses'])
+
+        body = self._get(urls, '/_metrics')
+        self.assertTrue('robaccia_requests_total{route="/comments/{id}",method="GET"} 2' in body)
+        self.assertTrue('robaccia_responses_total{route="/comments/{id}",method="GET",status="200"} 2' in body)
+        self.assertTrue('robaccia_latency_seconds_bucket{route="/comments/{id}",method="GET",phase="db",le="0.0025"} 2' in body)
+        self.assertTrue('robaccia_latency_seconds_count{route="/comments/{id}",method="GET",phase="handler"} 2' in body)
+
+    def test_lazy_response(self):
+        metrics = Metrics()
+        def app(environ, start_response):
+            start_response("201 Created", [])
+            yield "created"
+        urls = Dispatcher(self._missing, metrics=metrics)
+        urls.add('/things', POST=app)
+        result = urls({'PATH_INFO': '/things', 'REQUEST_METHOD': 'POST'}, self._start_response)
+        self.assertEqual({}, metrics.snapshot())
+        self.assertEqual("created", "".join(result))
+        result.close()
+        self.assertEqual({'201': 1}, metrics.snapshot()[('/things', 'POST')]['statuses'])
+
+        self._get(urls, '/things', 'BREW')
+        self._get(urls, '/things', 'FROB')
+        self.assertEqual({'404': 2}, metrics.snapshot()[('-', 'OTHER')]['statuses'])
@@ -83,6 +83,98 @@ class Test(unittest.TestCase):
         robaccia.TEMPLATE_DIRS = [os.path.join("tests", "input", "templates")]
         self.assertEqual(['<html><body><p>Hello World!</p></body></html>'], robaccia.render({}, self._start_response, 'list.html', {'a':1}, raw_etag="foo"))
         
+    def test_render_stream(self):
+        os.chdir(BASE)
+        body = robaccia.render({}, self._start_response, 'list.json', {'a': (i for i in range(3))}, stream=True)
+        self.assertEqual('{"a": [0, 1, 2]}', "".join(body))
+        robaccia.TEMPLATE_DIRS = [os.path.join("tests", "input", "templates")]
+        environ = {robaccia.STREAM_KEY: True}
+        body = robaccia.render(environ, self._start_response, 'list.html', {})
+        self.assertFalse(isinstance(body, list))
+        self.assertEqual('<html><body><p>Hello World!</p></body></html>', "".join(body))
+        self.assertEqual([u'ab', u'cd', u'e'], list(robaccia.buffered([u'a', u'b', u'c', u'd', u'e'], size=2)))
+        self.assertEqual(['\xc3\xa9'], list(robaccia.buffered([u'\xe9'], encoding='utf-8')))
+
+    def test_template_index(self):
+        for dir in ["first", os.path.join("second", "fred")]:
+            os.makedirs(dir)
+        file(os.path.join("first", "list.html"), "w").close()
+        file(os.path.join("second", "list.html"), "w").close()
+        file(os.path.join("second", "fred", "list.html"), "w").close()
+        index = robaccia.TemplateIndex(["first", "second"])
+        self.assertEqual(os.path.join(SCRATCH, "first", "list.html"), index.find("list.html")[0])
+        self.assertEqual(os.path.join(SCRATCH, "second", "fred", "list.html"), index.find(os.path.join("fred", "list.html"))[0])
+        self.assertEqual(None, index.find("retrieve.html"))
+        self.assertFalse(index.reload())
+        file(os.path.join("second", "retrieve.html"), "w").close()
+        self.assertEqual(None, index.find("retrieve.html"))
+        self.assertTrue(index.reload())
+        self.assertEqual(os.stat(os.path.join("second", "retrieve.html")).st_mtime, index.find("retrieve.html")[1])
+        self.assertTrue(index is not robaccia.template_index(["first", "second"]))
+        self.assertTrue(robaccia.template_index(["first"]) is robaccia.template_index([os.path.join(SCRATCH, "first")]))
+
+    def test_template_cache(self):
+        os.chdir(BASE)
+        dirs = [os.path.join("tests", "input", "templates")]
+        loader = robaccia.template_loader(dirs)
+        self.assertTrue(loader is robaccia.template_loader(list(dirs)))
+        hits = robaccia.template_stats()['hits']
+        for i in range(3):
+            self.assertEqual('<html><body><p>Hello World!</p></body></html>', robaccia.genshi_templater(dirs, 'list.html', {}, 'html'))
+        self.assertEqual(1, loader.misses)
+        self.assertTrue(robaccia.template_stats()['hits'] >= hits + 2)
+
+    def test_reload_templates(self):
+        os.makedirs("reloaded")
+        def write(text):
+            f = file(os.path.join("reloaded", "page.html"), "w")
+            f.write('<p xmlns:py="http://genshi.edgewall.org/">%s</p>' % text)
+            f.close()
+        write("Before")
+        dirs = [os.path.join(SCRATCH, "reloaded")]
+        self.assertEqual('<p>Before</p>', robaccia.genshi_templater(dirs, 'page.html', {}, 'html'))
+        write("After")
+        self.assertEqual('<p>Before</p>', robaccia.genshi_templater(dirs, 'page.html', {}, 'html'))
+        robaccia.reload_templates()
+        self.assertEqual('<p>After</p>', robaccia.genshi_templater(dirs, 'page.html', {}, 'html'))
+
     def test_parse_json(self):
         pass
 
+    def test_view_registry(self):
+        os.makedirs(os.path.join("registry", "testviews"))
+        file(os.path.join("registry", "testviews", "__init__.py"), "w").close()
+        f = file(os.path.join("registry", "testviews", "fred.py"), "w")
+        f.write(FRED)
+        f.close()
+        sys.path.insert(0, os.path.join(SCRATCH, "registry"))
+        try:
+            registry = robaccia.ViewRegistry("testviews")
+            self.assertEqual(["fred"], registry.preload())
+            app = registry.resolve("fred")
+            self.assertEqual(app, registry.resolve("fred"))
+            self.assertEqual(None, registry.resolve("barney"))
+            self.assertFalse("barney" in registry._views)
+            self.assertTrue("barney" in registry._missing)
+            environ = {"wsgiorg.routing_args": ([], {'view': 'barney'})}
+            self.assertEqual(["<h1>File Not Found</h1>"], registry(environ, self._start_response))
+
+            f = file(os.path.join("registry", "testviews", "fred.py"), "w")
+            f.write(FRED.replace("Hello", "Goodbye"))
+            f.close()
+            os.utime(os.path.join("registry", "testviews", "fred.py"), (0, 0))
+            environ = {"wsgiorg.routing_args": ([], {'view': 'fred', 'id': 'anid', 'noun': 'somenoun'})}
+            self.assertEqual(["Hello anid-somenoun"], registry(environ, self._start_response))
+            registry.reload = True
+            self.assertEqual(["Goodbye anid-somenoun"], registry(environ, self._start_response))
+
+            registry = robaccia.ViewRegistry("testviews", missing_size=2)
+            for name in ["barney", "wilma", "betty", "dino"]:
+                self.assertEqual(None, registry.resolve(name))
+            self.assertEqual(2, len(registry._missing))
+            self.assertEqual({}, registry._views)
+        finally:
+            sys.path.remove(os.path.join(SCRATCH, "registry"))
+            for name in ["testviews", "testviews.fred"]:
+                sys.modules.pop(name, None)
+
@@ -0,0 +1,127 @@
+import unittest
+import time
+from robaccia.rowcache import RowCache, LocalBackend, MemcacheBackend
+from robaccia.rows import row_class
+
+Row = row_class(['id', 'description'])
+_now = time.time
+
+class FakeClient(object):
+    """Stands in for a memcache.Client, checking that keys are ones
+    memcached would accept."""
+    def __init__(self):
+        self.data = {}
+
+    def _check(self, key):
+        assert isinstance(key, str) and len(key) <= 250
+        for c in key:
+            assert ord(c) > 32 and ord(c) != 127, key
+
+    def get(self, key):
+        self._check(key)
+        (value, expires) = self.data.get(key, (None, 0))
+        if expires and expires < _now():
+            return None
+        return value
+
+    def set(self, key, value, time=0):
+        self._check(key)
+        assert isinstance(value, str)
+        expires = 0
+        if time:
+            expires = _now() + time
+        self.data[key] = (value, expires)
+        return True
+
+    def add(self, key, value, time=0):
+        if self.get(key) != None:
+            return False
+        return self.set(key, value, time)
+
+    def delete(self, key):
+        self._check(key)
+        self.data.pop(key, None)
+        return 1
+
+
+def fill(c, table, id, row):
+    """Caches row as a read through the cache would."""
+    c.put(table, id, row, c.version(table, id))
+
+
+class Test(unittest.TestCase):
+
+    def test_local(self):
+        c = RowCache()
+        self.assertEqual((False, None), c.get('fred', 1))
+        fill(c, 'fred', 1, Row((1, u'First Post!')))
+        (found, row) = c.get('fred', 1)
+        self.assertTrue(found)
+        self.assertEqual({'id': 1, 'description': u'First Post!'}, row)
+        self.assertEqual(['id', 'description'], row.keys())
+        fill(c, 'fred', 2, None)
+        self.assertEqual((True, None), c.get('fred', 2))
+        self.assertEqual((False, None), c.get('barney', 1))
+        c.invalidate('fred', 1)
+        self.assertEqual((False, None), c.get('fred', 1))
+        self.assertEqual({'hits': 1, 'negative_hits': 1, 'misses': 3}, dict([(k, v) for (k, v) in c.stats().items() if k != 'backend']))
+
+    def test_ttl(self):
+        c = RowCache(ttl=0.01, negative_ttl=0)
+        fill(c, 'fred', 1, Row((1, u'First Post!')))
+        fill(c, 'fred', 2, None)
+        self.assertEqual((False, None), c.get('fred', 2))
+        self.assertTrue(c.get('fred', 1)[0])
+        time.sleep(0.02)
+        self.assertEqual((False, None), c.get('fred', 1))
+
+    def test_version(self):
+        c = RowCache()
+        version = c.version('fred', 1)
+        c.invalidate('fred', 1)
+        c.put('fred', 1, Row((1, u'Stale')), version)
+        self.assertEqual((False, None), c.get('fred', 1))
+        fill(c, 'fred', 1, Row((1, u'Fresh')))
+        self.assertEqual(u'Fresh', c.get('fred', 1)[1]['description'])
+
+        # A row that can't be stored as JSON isn't cached.
+        import datetime
+        fill(c, 'fred', 2, Row((2, datetime.datetime.now())))
+        self.assertEqual((False, None), c.get('fred', 2))
+
+    def test_max_bytes(self):
+        c = RowCache(LocalBackend(max_bytes=1000))
+        for i in range(20):
+            fill(c, 'fred', i, Row((i, u'x' * 100)))
+        self.assertTrue(c.backend.bytes <= 1000)
+        self.assertEqual((False, None), c.get('fred', 0))
+        self.assertTrue(c.get('fred', 19)[0])
+
+    def test_memcache(self):
+        client = FakeClient()
+        c = RowCache(MemcacheBackend(client))
+        fill(c, 'fred', 'a key with spaces', Row((1, u'First Post!')))
+        fill(c, 'fred', u'caf\xe9', None)
+        self.assertEqual(u'First Post!', c.get('fred', 'a key with spaces')[1]['description'])
+        self.assertEqual((True, None), c.get('fred', u'caf\xe9'))
+        for key in client.data:
+            self.assertTrue(key.startswith('robaccia:fred:'))
+
+        # Another process sharing the memcached sees the row, and
+        # the invalidations made by this one.
+        other = RowCache(MemcacheBackend(client))
+        self.assertTrue(other.get('fred', 'a key with spaces')[0])
+        c.invalidate('fred', 'a key with spaces')
+        self.assertEqual((False, None), other.get('fred', 'a key with spaces'))
+
+        # A row read by another process before this one changed it is
+        # not served once the other process stores it.
+        version = other.version('fred', 3)
+        c.invalidate('fred', 3)
+        other.put('fred', 3, Row((3, u'Stale')), version)
+        self.assertEqual((False, None), c.get('fred', 3))
+        self.assertEqual((False, None), other.get('fred', 3))
+
+        # Nothing but JSON is read back from memcached.
+        client.data['robaccia:fred:4'] = ("cos\nsystem\n(S'true'\ntR.", 0)
+        self.assertEqual((False, None), c.get('fred', 4))
@@ -0,0 +1,40 @@
+import unittest
+from robaccia.rows import row_class
+from robaccia.jsonstream import dumps, iterencode, loads
+
+class Test(unittest.TestCase):
+
+    def test_mapping(self):
+        cls = row_class(['id', 'description'])
+        self.assertTrue(cls is row_class(('id', 'description')))
+        row = cls((1, u'First Post!'))
+        self.assertEqual(1, row['id'])
+        self.assertEqual(u'First Post!', row.get('description'))
+        self.assertEqual(None, row.get('missing'))
+        self.assertRaises(KeyError, lambda: row['missing'])
+        self.assertTrue('id' in row)
+        self.assertFalse(1 in row)
+        self.assertEqual(['id', 'description'], list(row))
+        self.assertEqual(['id', 'description'], row.keys())
+        self.assertEqual([1, u'First Post!'], row.values())
+        self.assertEqual([('id', 1), ('description', u'First Post!')], list(row.iteritems()))
+        self.assertEqual({'id': 1, 'description': u'First Post!'}, dict(row))
+        self.assertEqual(2, len(row))
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_equality(self):
+        cls = row_class(['id', 'description'])
+        row = cls((1, u'First Post!'))
+        self.assertEqual(row, {'id': 1, 'description': u'First Post!'})
+        self.assertEqual({'row': {'id': 1, 'description': u'First Post!'}}, {'row': row})
+        self.assertNotEqual(row, {'id': 1})
+        self.assertNotEqual(row, {'id': 2, 'description': u'First Post!'})
+        self.assertEqual(row, cls((1, u'First Post!')))
+        self.assertNotEqual(row, row_class(['description', 'id'])((1, u'First Post!')))
+        self.assertNotEqual(row, (1, u'First Post!'))
+
+    def test_json(self):
+        row = row_class(['id', '100%'])((1, u'Caf\xe9'))
+        self.assertEqual({'id': 1, '100%': u'Caf\xe9'}, loads(dumps(row)))
+        self.assertEqual('{"id": 1, "100%": "Caf\\u00e9"}', dumps(row))
+        self.assertEqual('{"data": [{"id": 1, "100%": "Caf\\u00e9"}]}', "".join(iterencode({'data': [row]})))